@@ -1,20 +1,60 @@
 import sys
 import os
+import asyncio
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 
 # Add the project root directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from api.services.audio_service import AudioService
-from models.camembert_ner_model import CamemBERTNERModel
-from models.travel_intent_classifier_model import TravelIntentClassifierModel
-from services.sncf.sncf_route_finder import SNCFRouteFinder
+from api.services.model_registry import registry, ComponentNotReadyError
+from api.services.route_cache import route_cache, RouteCache
+from services.sncf.gtfs_compiler import GTFSCompiler
+from services.sncf.stop_name_index import StopNameIndex
 from services.voice_to_text_converter import VoiceToTextConverter
-from services.language_detection import LanguageIdentification
 
-app = FastAPI()
+# Seconds between two checks of the GTFS files for an update (no automatic reload when unset)
+SNCF_FEED_WATCH_INTERVAL = os.environ.get("SNCF_FEED_WATCH_INTERVAL")
+# Token expected in the X-Admin-Token header of the admin endpoints (no check when unset)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+async def watch_sncf_feed(interval):
+    """
+    Reloads the SNCF route finder when the GTFS files change. The reload starts once the files are the same
+    on two checks in a row, so that a feed being copied is not loaded half written.
+    """
+    compiler = GTFSCompiler()
+    loaded = previous = compiler.source_signature()
+    while True:
+        await asyncio.sleep(interval)
+        current = compiler.source_signature()
+        if current != loaded and current == previous:
+            logger.info("The GTFS files changed, reloading the SNCF route finder")
+            if await asyncio.to_thread(registry.reload, "sncf_route_finder"):
+                loaded = current
+        previous = current
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the models and the route finder once, in the background, so that the health endpoint answers meanwhile
+    app.state.registry_loading = asyncio.create_task(asyncio.to_thread(registry.load))
+    feed_watcher = None
+    if SNCF_FEED_WATCH_INTERVAL:
+        feed_watcher = asyncio.create_task(watch_sncf_feed(float(SNCF_FEED_WATCH_INTERVAL)))
+    yield
+    if feed_watcher:
+        feed_watcher.cancel()
+    await app.state.registry_loading
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -26,6 +66,16 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def get_component(name):
+    """
+    Returns a shared component from the registry, or answers 503 while it is not ready.
+    """
+    try:
+        return registry.get(name)
+    except ComponentNotReadyError as e:
+        raise HTTPException(status_code=503, detail=f"Service not ready: {e}")
+
+
 class SentenceRequest(BaseModel):
     sentence: str
 
@@ -46,15 +96,95 @@ class RoutePoint(BaseModel):
     stop_id: str
     latitude: float
     longitude: float
+    route_name: Optional[str] = None  # Line taken to reach this stop
 
 
 class RouteResponse(BaseModel):
     departure: str
     destination: str
     route: list[RoutePoint]
+    duration_minutes: float
+    trip_id: Optional[str] = None  # Set when a direct train serves both cities
+
+
+class BatchRouteRequest(BaseModel):
+    departure: str
+    destinations: list[str]
+
+
+class BatchRoute(BaseModel):
+    destination: str
+    route: Optional[list[RoutePoint]] = None  # None when no route was found
+    duration_minutes: Optional[float] = None
+
+
+class BatchRouteResponse(BaseModel):
+    departure: str
+    routes: list[BatchRoute]
 
 
-# 2. Route to convert audio file to text
+class Departure(BaseModel):
+    trip_id: str
+    stop_id: str
+    stop_name: Optional[str] = None
+    departure_time: str
+    route_name: Optional[str] = None
+    headsign: Optional[str] = None
+
+
+class DepartureBoardResponse(BaseModel):
+    station: str
+    date: str
+    time: str
+    departures: list[Departure]
+
+
+# Maximum number of destinations of a batch route request
+MAX_BATCH_DESTINATIONS = 1000
+# Isochrones are reused across many map renders: cached per departure city, budget and date
+isochrone_cache = RouteCache(max_size=256)
+
+
+def build_route_points(sncf_route_finder, path, trip=None):
+    """
+    Transforms a path of stop indices into a RoutePoint list, with the line taken to reach every stop.
+    The route finder only handles indices: the stop ids and names are looked up here, for the response.
+    """
+    route_names = [None] + sncf_route_finder.route_names(path, trip=trip)
+    stops = [sncf_route_finder.stops.record(stop) for stop in path]
+    return [
+        RoutePoint(
+            stop_name=stop.name,
+            stop_id=stop.stop_id,
+            latitude=stop.lat,
+            longitude=stop.lon,
+            route_name=route_name
+        )
+        for stop, route_name in zip(stops, route_names)
+    ]
+
+
+# 1. Route to check the readiness of the shared models
+@app.get("/api/health")
+async def health():
+    return {**registry.status(), "route_cache": route_cache.stats(), "isochrone_cache": isochrone_cache.stats()}
+
+
+# 2. Route to reload the SNCF feed without restarting the server
+@app.post("/api/admin/reload-sncf-feed", status_code=202)
+async def reload_sncf_feed(x_admin_token: Optional[str] = Header(default=None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    status = registry.status()["components"]["sncf_route_finder"]
+    if status["state"] == registry.LOADING or (status["reload"] and status["reload"]["in_progress"]):
+        raise HTTPException(status_code=409, detail="The SNCF route finder is already loading.")
+
+    # The new route finder is built in the background; requests keep using the current one until it is swapped in
+    app.state.sncf_feed_reload = asyncio.create_task(asyncio.to_thread(registry.reload, "sncf_route_finder"))
+    return {"detail": "Reload started.", "version": status["version"]}
+
+
+# 3. Route to convert audio file to text
 @app.post("/api/audio-to-text", response_model=SentenceRequest)
 async def audio_to_text_route(file: UploadFile = File(...)):
     logger.info(f"Processing file: {file.filename}")
@@ -77,16 +207,16 @@ async def audio_to_text_route(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="Audio processing failed: {}".format(str(e)))
 
 
-# 3. Route to validate the text (check French and travel intention)
+# 4. Route to validate the text (check French and travel intention)
 @app.post("/api/validate-travel-intent", response_model=ValidationResponse)
 async def validate_travel_intent(request: SentenceRequest):
     logger.info(f"Validating sentence: {request.sentence}")
-    lang_identifier = LanguageIdentification()
+    lang_identifier = get_component("language_identifier")
+    trip_intent_classifier_model = get_component("trip_intent_classifier_model")
     lang, confidence = lang_identifier.stat_print(request.sentence)
 
     is_correct_language = lang[0] == "__label__fr"
 
-    trip_intent_classifier_model = TravelIntentClassifierModel()
     is_trip_related = trip_intent_classifier_model.predict(request.sentence) == 1
 
     if not is_correct_language:
@@ -105,12 +235,13 @@ async def validate_travel_intent(request: SentenceRequest):
                               is_trip_related=True)
 
 
-# 4. Route to extract cities and find the SNCF route
+# 5. Route to extract cities and find the SNCF route
 @app.post("/api/sncf/find-route", response_model=RouteResponse)
 async def find_route_sncf(request: SentenceRequest):
     logger.info(f"Extracting trip details from: {request.sentence}")
-    camembert_ner_model = CamemBERTNERModel()
-    camembert_ner_model.load_model()
+    camembert_ner_model = get_component("camembert_ner_model")
+    city_name_index = get_component("city_name_index")
+    sncf_route_finder = get_component("sncf_route_finder")
     departure, destination = camembert_ner_model.extract_trip_details(request.sentence)
 
     if not departure or not destination:
@@ -118,27 +249,112 @@ async def find_route_sncf(request: SentenceRequest):
         raise HTTPException(status_code=400,
                             detail="Unable to extract both departure and destination from the sentence.")
 
-    sncf_route_finder = SNCFRouteFinder()
-    route = sncf_route_finder.find_shortest_route(departure, destination)
-
-    if route:
-        # Transform the result into a RoutePoint list
-        route_points = [
-            RoutePoint(
-                stop_name=sncf_route_finder.stops[stop_id]['name'],
-                stop_id=stop_id,
-                latitude=sncf_route_finder.stops[stop_id]['lat'],
-                longitude=sncf_route_finder.stops[stop_id]['lon']
-            )
-            for stop_id in route
-        ]
+    # Misspelled cities ("Montpelier") are snapped to the closest city name, when no stop name matches them
+    departure = sncf_route_finder.snap_city_name(departure, city_name_index)
+    destination = sncf_route_finder.snap_city_name(destination, city_name_index)
+
+    def resolve_route():
+        # Direct trains are looked up first, the graph is only searched for the journeys with connections
+        result = sncf_route_finder.search_route(departure, destination, direct_first=True)
+        if not result or not result.path:
+            return None
+        trip_id = None if result.trip is None else sncf_route_finder.trip_ids[result.trip]
+        return build_route_points(sncf_route_finder, result.path, result.trip), result.cost, trip_id
 
+    # Same city pair already resolved (or being resolved) on the loaded feed: no new search
+    resolved = await route_cache.get_or_compute(route_cache.key(departure, destination),
+                                                sncf_route_finder.feed_version, resolve_route)
+
+    if resolved:
+        route_points, duration_minutes, trip_id = resolved
         logger.info(f"Route found from {departure} to {destination}: {route_points}")
-        return RouteResponse(departure=departure, destination=destination, route=route_points)
+        return RouteResponse(departure=departure, destination=destination, route=route_points,
+                             duration_minutes=duration_minutes, trip_id=trip_id)
     else:
         logger.error(f"No route found from {departure} to {destination}")
         raise HTTPException(status_code=404, detail=f"No route found from {departure} to {destination}.")
 
 
+# 6. Route to list the next departures from a station
+@app.get("/api/sncf/departures", response_model=DepartureBoardResponse)
+async def departures_sncf(station: str, time: Optional[str] = None, date: Optional[str] = None,
+                          count: int = Query(default=10, ge=1, le=100)):
+    sncf_route_finder = get_component("sncf_route_finder")
+    # Now, by default
+    now = datetime.now()
+    time = time or now.strftime("%H:%M:%S")
+    date = date or now.strftime("%Y-%m-%d")
+    try:
+        departures = sncf_route_finder.departures(station, time, date, count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date or time: {e}")
+
+    if departures is None:
+        raise HTTPException(status_code=404, detail=f"No station found for {station}.")
+    return DepartureBoardResponse(station=station, date=date, time=time,
+                                  departures=[Departure(**departure) for departure in departures])
+
+
+# 7. Route to map the stations reachable from a city within a time budget
+@app.get("/api/sncf/isochrone")
+async def isochrone_sncf(departure: str, max_minutes: int = Query(ge=0, le=24 * 60), date: Optional[str] = None):
+    sncf_route_finder = get_component("sncf_route_finder")
+
+    def build_isochrone():
+        isochrone = sncf_route_finder.isochrone(departure, max_minutes, date)
+        if isochrone is None:
+            return None
+        # GeoJSON FeatureCollection, one point per reachable stop (stops without coordinates left out)
+        return {
+            "type": "FeatureCollection",
+            "properties": {"departure": departure, "max_minutes": max_minutes, "date": date},
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+                    "properties": {
+                        "stop_id": sncf_route_finder.stops.stop_ids[stop],
+                        "stop_name": sncf_route_finder.stops.name(stop),
+                        "minutes": minutes,
+                    },
+                }
+                for stop, latitude, longitude, minutes in zip(isochrone['stops'], isochrone['latitudes'],
+                                                              isochrone['longitudes'], isochrone['minutes'])
+                if latitude == latitude
+            ],
+        }
 
+    try:
+        geojson = await isochrone_cache.get_or_compute((StopNameIndex.normalize(departure), max_minutes, date),
+                                                       sncf_route_finder.feed_version, build_isochrone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {e}")
+
+    if geojson is None:
+        raise HTTPException(status_code=404, detail=f"No station found for {departure}.")
+    return geojson
+
+
+# 8. Route to find the SNCF routes from one departure city to many destination cities
+@app.post("/api/sncf/find-routes", response_model=BatchRouteResponse)
+async def find_routes_sncf(request: BatchRouteRequest):
+    if not request.destinations:
+        raise HTTPException(status_code=400, detail="At least one destination is required.")
+    if len(request.destinations) > MAX_BATCH_DESTINATIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {MAX_BATCH_DESTINATIONS} destinations can be requested at once.")
+    logger.info(f"Finding routes from {request.departure} to {len(request.destinations)} destinations")
+    sncf_route_finder = get_component("sncf_route_finder")
+
+    def resolve_routes():
+        # A single shortest path tree from the departure city serves every destination
+        results = sncf_route_finder.search_routes(request.departure, request.destinations)
+        return [
+            BatchRoute(destination=destination, route=build_route_points(sncf_route_finder, result.path),
+                       duration_minutes=result.cost)
+            if result and result.path else BatchRoute(destination=destination)
+            for destination, result in ((destination, results[destination]) for destination in request.destinations)
+        ]
 
+    routes = await asyncio.to_thread(resolve_routes)
+    return BatchRouteResponse(departure=request.departure, routes=routes)
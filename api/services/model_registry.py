@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+
+from models.camembert_ner_model import CamemBERTNERModel
+from models.travel_intent_classifier_model import TravelIntentClassifierModel
+from services.language_detection import LanguageIdentification
+from services.sncf.fuzzy_name_index import FuzzyNameIndex
+from services.sncf.sncf_route_finder import SNCFRouteFinder
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentNotReadyError(RuntimeError):
+    """
+    Raised when a request needs a component that is still loading or failed to load.
+    """
+
+
+class ModelRegistry:
+    """
+    Process-wide registry holding the heavy models and the SNCF route finder.
+
+    Every component is loaded once (from the app lifespan) and then shared read-only
+    by all the request handlers, instead of being rebuilt for each request.
+    A component can be reloaded while the API is running: the new instance is built on the side and swapped in
+    atomically, the requests that already hold the previous instance finishing with it.
+    """
+
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    COMPONENTS = ("language_identifier", "trip_intent_classifier_model", "camembert_ner_model", "city_name_index",
+                  "sncf_route_finder")
+
+    def __init__(self):
+        self.language_identifier = None
+        self.trip_intent_classifier_model = None
+        self.camembert_ner_model = None
+        self.city_name_index = None
+        self.sncf_route_finder = None
+
+        self._factories = {
+            "language_identifier": LanguageIdentification,
+            "trip_intent_classifier_model": TravelIntentClassifierModel,
+            "camembert_ner_model": self._load_camembert_ner_model,
+            "city_name_index": FuzzyNameIndex.load_cities,
+            "sncf_route_finder": SNCFRouteFinder,
+        }
+
+        self._lock = threading.Lock()
+        self._states = {name: self.LOADING for name in self.COMPONENTS}
+        self._errors = {}
+        self._load_times = {}
+        self._reloads = {}
+
+    def load(self):
+        """
+        Loads every component, one after the other. A failing component is recorded as
+        failed without preventing the others from loading.
+        """
+        for name in self.COMPONENTS:
+            self._load_component(name, self._factories[name])
+
+    @staticmethod
+    def _load_camembert_ner_model():
+        camembert_ner_model = CamemBERTNERModel()
+        camembert_ner_model.load_model()
+        if camembert_ner_model.model is None:
+            raise RuntimeError(f"No trained NER model found in {camembert_ner_model.output_dir}.")
+        return camembert_ner_model
+
+    def _load_component(self, name, factory):
+        logger.info(f"Loading {name}...")
+        start = time.perf_counter()
+        try:
+            component = factory()
+        except Exception as e:
+            logger.error(f"Failed to load {name}: {e}")
+            with self._lock:
+                self._states[name] = self.FAILED
+                self._errors[name] = str(e)
+            return
+
+        with self._lock:
+            setattr(self, name, component)
+            self._states[name] = self.READY
+            self._load_times[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"{name} loaded in {self._load_times[name]} s")
+
+    def reload(self, name):
+        """
+        Builds a new instance of a component and swaps it in once it is complete. Until then, and if the
+        build fails, the current instance keeps serving the requests.
+        Returns False, without doing anything, when the component is loading or already reloading.
+        """
+        with self._lock:
+            reload = self._reloads.setdefault(name, {"in_progress": False, "count": 0, "started_at": None,
+                                                     "duration_seconds": None, "error": None})
+            if self._states[name] == self.LOADING or reload["in_progress"]:
+                return False
+            reload.update(in_progress=True, started_at=time.time(), error=None)
+
+        logger.info(f"Reloading {name}...")
+        start = time.perf_counter()
+        try:
+            component = self._factories[name]()
+        except Exception as e:
+            logger.error(f"Failed to reload {name}, keeping the current one: {e}")
+            with self._lock:
+                reload.update(in_progress=False, duration_seconds=round(time.perf_counter() - start, 3),
+                              error=str(e))
+            return True
+
+        with self._lock:
+            setattr(self, name, component)
+            self._states[name] = self.READY
+            self._errors.pop(name, None)
+            reload.update(in_progress=False, duration_seconds=round(time.perf_counter() - start, 3))
+            reload["count"] += 1
+        logger.info(f"{name} reloaded in {reload['duration_seconds']} s")
+        return True
+
+    def get(self, name):
+        """
+        Returns a loaded component, or raises ComponentNotReadyError if it is not available.
+        """
+        with self._lock:
+            state = self._states[name]
+        if state != self.READY:
+            raise ComponentNotReadyError(f"{name} is {state}.")
+        return getattr(self, name)
+
+    @property
+    def is_ready(self):
+        with self._lock:
+            return all(state == self.READY for state in self._states.values())
+
+    def status(self):
+        """
+        Returns the readiness state of every component, for the health endpoint.
+        """
+        with self._lock:
+            return {
+                "ready": all(state == self.READY for state in self._states.values()),
+                "components": {
+                    name: {
+                        "state": state,
+                        "load_time_seconds": self._load_times.get(name),
+                        "error": self._errors.get(name),
+                        "version": getattr(getattr(self, name), "feed_version", None),
+                        "reload": dict(self._reloads[name]) if name in self._reloads else None,
+                    }
+                    for name, state in self._states.items()
+                },
+            }
+
+
+registry = ModelRegistry()
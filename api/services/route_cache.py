@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+
+from services.sncf.stop_name_index import StopNameIndex
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of the resolved routes, with a time to live.
+
+    Entries are keyed by the normalized departure and destination cities and by the date and departure time bucket
+    of the query, and belong to the feed version they were computed from: the whole cache is dropped as soon as
+    another feed version is queried. Identical queries arriving while the route is being computed are coalesced:
+    a single search runs and the other requests await its result.
+    Meant to be used from the event loop of the API only (not thread-safe).
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=3600, bucket_seconds=15 * 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.bucket_seconds = bucket_seconds
+        self.feed_version = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (expiry, value)
+        self._pending = {}  # key -> asyncio.Task of the running computation
+
+    def key(self, departure, destination, date=None, departure_time=None):
+        """
+        Cache key of a query: departure_time (seconds since the start of the service day) is rounded down to
+        bucket_seconds.
+        """
+        bucket = None if departure_time is None else departure_time // self.bucket_seconds
+        return StopNameIndex.normalize(departure), StopNameIndex.normalize(destination), date, bucket
+
+    async def get_or_compute(self, key, feed_version, compute):
+        """
+        Returns the cached value of key (from the key method, or any hashable tuple) for the feed version, or runs
+        compute() (a blocking function, run in a worker thread) once for all the concurrent identical queries and
+        caches its result.
+        Exceptions are propagated to every waiting request and never cached.
+        """
+        if feed_version != self.feed_version:
+            if self.feed_version is not None:
+                logger.info(f"Feed version changed ({self.feed_version} -> {feed_version}), clearing the route cache")
+            self.clear()
+            self.feed_version = feed_version
+        key = (feed_version, *key)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expiry, value = entry
+            if expiry > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(asyncio.to_thread(compute))
+            self._pending[key] = task
+            task.add_done_callback(functools.partial(self._store, key, feed_version))
+        # shield: a cancelled request, the one that started the computation included, does not cancel the
+        # computation shared with the others
+        return await asyncio.shield(task)
+
+    def _store(self, key, feed_version, task):
+        """
+        Done callback of a computation: caches its result, unless it failed or the feed version changed meanwhile.
+        """
+        del self._pending[key]
+        # exception() also marks the exception as retrieved, so that asyncio does not log it when nobody awaited it
+        if task.cancelled() or task.exception() is not None or self.feed_version != feed_version:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, task.result())
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Counters of the cache, for the health endpoint.
+        """
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "feed_version": self.feed_version,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
+
+
+route_cache = RouteCache()
@@ -13,9 +13,9 @@ class CityManager:
     Retrieves cities via the French government's Geo API.
     """
 
-    def fetch_cities(self, limit=100000):
+    def fetch_cities(self, limit=100000, fields="nom"):
         params = {
-            "fields": "nom",
+            "fields": fields,
             "format": "json",
             "geometry": "centre",
             "limit": limit
@@ -35,3 +35,13 @@ class CityManager:
     @staticmethod
     def get_cities_names(cities):
         return [city["nom"] for city in cities]
+
+    """
+    Formats city data as (name, latitude, longitude) tuples, for the cities fetched with their "centre" field.
+    """
+
+    @staticmethod
+    def get_cities_coordinates(cities):
+        # The centre is a GeoJSON point: [longitude, latitude]
+        return [(city["nom"], city["centre"]["coordinates"][1], city["centre"]["coordinates"][0])
+                for city in cities if city.get("centre")]
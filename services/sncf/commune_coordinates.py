@@ -0,0 +1,69 @@
+import csv
+import logging
+import os
+
+from services.sncf.stop_name_index import StopNameIndex
+
+"""
+Coordinates of the French communes, read from a local CSV file (city, lat, lon), so that a town without a station
+of its name can be located without any network call. The file is downloaded once from the Geo API of the French
+government (see __main__) and kept next to datasets/city.csv.
+Names are matched like the stop names (StopNameIndex.normalize); for homonymous communes the first one of the file
+is kept.
+"""
+
+logger = logging.getLogger(__name__)
+
+COMMUNE_COORDINATES_PATH = 'datasets/city_coordinates.csv'
+
+
+class CommuneCoordinates:
+    def __init__(self, coordinates=None):
+        """
+        coordinates is a {normalized name: (latitude, longitude)} mapping.
+        """
+        self.coordinates = coordinates or {}
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    @classmethod
+    def load(cls, path=COMMUNE_COORDINATES_PATH):
+        """
+        Reads the commune file. A missing file gives an empty index (no commune can be located).
+        """
+        coordinates = {}
+        if not os.path.exists(path):
+            logger.warning(f"No commune coordinates file at {path}, towns without a station cannot be located.")
+            return cls(coordinates)
+        with open(path, mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                coordinates.setdefault(StopNameIndex.normalize(row['city']), (float(row['lat']), float(row['lon'])))
+        return cls(coordinates)
+
+    def lookup(self, city_name):
+        """
+        Returns the (latitude, longitude) of the commune, or None if it is unknown.
+        """
+        return self.coordinates.get(StopNameIndex.normalize(city_name))
+
+    @staticmethod
+    def write(path, cities):
+        """
+        Writes the (name, latitude, longitude) tuples of the communes to path.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['city', 'lat', 'lon'])
+            writer.writerows(cities)
+
+
+if __name__ == '__main__':
+    from services.city_manager import CityManager
+
+    logging.basicConfig(level=logging.INFO)
+    city_manager = CityManager()
+    communes = city_manager.get_cities_coordinates(city_manager.fetch_cities(fields="nom,centre"))
+    CommuneCoordinates.write(COMMUNE_COORDINATES_PATH, communes)
+    logger.info(f"{len(communes)} commune coordinates written to {COMMUNE_COORDINATES_PATH}")
@@ -0,0 +1,183 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+"""
+Binary container for the compiled SNCF feed.
+
+Layout: MAGIC | uint32 format version | uint32 header length | JSON header (space padded) | 8-byte aligned sections.
+Each section is either a typed array (stored with the typecodes of the `array` module) or a table of strings
+(NUL-separated UTF-8). The file is opened with mmap, so arrays are read in place without being copied or parsed.
+The mapping is read-only and backed by the page cache: every process opening the same file (the API workers)
+shares a single copy of the arrays in memory.
+"""
+
+MAGIC = b"SNCFFEED"
+FORMAT_VERSION = 1
+STRINGS = "str"
+_ALIGNMENT = 8
+
+
+def to_array(typecode, values):
+    """
+    Copies a NumPy array (or any sequence of numbers) into a typed `array`, the in-memory form of the sections.
+    """
+    result = array(typecode)
+    result.frombytes(np.ascontiguousarray(values, dtype=np.dtype(typecode)).tobytes())
+    return result
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock associated with path (on path + '.lock'), held by a single process at a time, so that concurrent
+    processes do not build the same file together. Not available without fcntl (Windows), where it does nothing.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = path + '.lock'
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, mode='a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class CompiledFeedError(Exception):
+    """
+    Raised when a compiled feed file is missing, truncated or written in another format.
+    """
+
+
+class CompiledFeed:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, mode='rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise CompiledFeedError(f"Unable to open the compiled feed {path}: {e}")
+
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise CompiledFeedError(f"{path} is not a compiled SNCF feed.")
+        prefix = array('I', bytes(buffer[len(MAGIC):len(MAGIC) + 8]))
+        version, header_length = prefix[0], prefix[1]
+        if version != FORMAT_VERSION:
+            raise CompiledFeedError(f"{path} uses format version {version}, expected {FORMAT_VERSION}.")
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(bytes(buffer[header_start:header_start + header_length]).decode('utf-8'))
+        self._data_start = header_start + header_length
+        if self.header.get('byteorder') != sys.byteorder:
+            raise CompiledFeedError(f"{path} was compiled on a {self.header.get('byteorder')}-endian machine.")
+
+        self._buffer = buffer
+        self._strings = {}
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    @property
+    def source_hashes(self):
+        return self.header['source_hashes']
+
+    def has(self, name):
+        return name in self.header['sections']
+
+    def array(self, name):
+        """
+        Returns a read-only typed view over the section, backed by the mmap (no copy).
+        """
+        section = self.header['sections'][name]
+        start = self._data_start + section['offset']
+        view = self._buffer[start:start + section['nbytes']]
+        return view.cast(section['typecode'])
+
+    def strings(self, name):
+        """
+        Returns the string table of the section as a list (decoded once, then cached).
+        """
+        if name not in self._strings:
+            section = self.header['sections'][name]
+            if section['length'] == 0:
+                self._strings[name] = []
+            else:
+                start = self._data_start + section['offset']
+                raw = bytes(self._buffer[start:start + section['nbytes']])
+                self._strings[name] = raw.decode('utf-8').split('\0')
+        return self._strings[name]
+
+    @staticmethod
+    def write(path, sections, metadata=None, source_hashes=None):
+        """
+        Writes the sections ({name: array | list of str}) to path. The file is written next to its
+        destination then renamed, so readers never see a partially written feed.
+        """
+        payloads = []
+        header_sections = {}
+        offset = 0
+        for name, values in sections.items():
+            if isinstance(values, array):
+                typecode, payload, length = values.typecode, values.tobytes(), len(values)
+            else:
+                typecode, payload, length = STRINGS, '\0'.join(values).encode('utf-8'), len(values)
+            padding = -offset % _ALIGNMENT
+            offset += padding
+            header_sections[name] = {'typecode': typecode, 'offset': offset, 'nbytes': len(payload),
+                                     'length': length}
+            payloads.append((padding, payload))
+            offset += len(payload)
+
+        header = {
+            'byteorder': sys.byteorder,
+            'metadata': metadata or {},
+            'source_hashes': source_hashes or {},
+            'sections': header_sections,
+        }
+        # Section offsets are relative to the (aligned) end of the header
+        encoded_header = json.dumps(header).encode('utf-8')
+        encoded_header += b' ' * (-(len(MAGIC) + 8 + len(encoded_header)) % _ALIGNMENT)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, mode='wb') as file:
+            file.write(MAGIC)
+            file.write(array('I', [FORMAT_VERSION, len(encoded_header)]).tobytes())
+            file.write(encoded_header)
+            for padding, payload in payloads:
+                file.write(b'\0' * padding)
+                file.write(payload)
+        os.replace(tmp_path, path)
+
+
+class InMemoryFeed:
+    """
+    Same reading interface as CompiledFeed, over sections built in memory (GTFSCompiler.build) instead of a file.
+    """
+
+    def __init__(self, sections, metadata):
+        self.sections = sections
+        self.metadata = metadata
+
+    def has(self, name):
+        return name in self.sections
+
+    def array(self, name):
+        return memoryview(self.sections[name])
+
+    def strings(self, name):
+        return self.sections[name]
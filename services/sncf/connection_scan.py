@@ -0,0 +1,140 @@
+from bisect import bisect_left
+from typing import NamedTuple
+
+import numpy as np
+from services.sncf.compiled_feed import to_array
+
+"""
+Time-dependent routing with the Connection Scan Algorithm (CSA).
+
+Every trip segment of stop_times.txt is an elementary connection (departure stop, arrival stop, departure time,
+arrival time, trip), and all the connections are kept in flat arrays sorted by departure time. An earliest-arrival
+query scans them once, from the requested departure time, and stops as soon as the connections leave after the best
+arrival found at a goal. Unlike the static graph, waiting times and connections between trains are real.
+
+Changing from a stop to another stop of the same station (the StopPoints of a StopArea) takes transfer_seconds.
+Staying on the same stop to catch another train is allowed as soon as the train has arrived.
+"""
+
+INFINITY = float('inf')
+NOT_REACHED = -1
+WALKED = -2
+DEFAULT_TRANSFER_SECONDS = 5 * 60
+
+
+class Leg(NamedTuple):
+    trip: int
+    departure_stop: int
+    departure_time: int
+    arrival_stop: int
+    arrival_time: int
+
+
+class ConnectionScan:
+    def __init__(self, departure_stops, arrival_stops, departure_times, arrival_times, trips, stop_stations,
+                 transfer_seconds=DEFAULT_TRANSFER_SECONDS):
+        self.departure_stops = departure_stops
+        self.arrival_stops = arrival_stops
+        self.departure_times = departure_times
+        self.arrival_times = arrival_times
+        self.trips = trips
+        self.stop_count = len(stop_stations)
+        self.trip_count = max(trips) + 1 if len(trips) else 0
+        self.transfer_seconds = transfer_seconds
+
+        # Stops sharing a station, for the transfers (only the stations with several stops are kept)
+        members = {}
+        for stop, station in enumerate(stop_stations):
+            members.setdefault(station, []).append(stop)
+        self.siblings = {}
+        for group in members.values():
+            if len(group) > 1:
+                for stop in group:
+                    self.siblings[stop] = [other for other in group if other != stop]
+
+    @staticmethod
+    def build_connections(segments):
+        """
+        Builds the connection arrays, sorted by departure time (then arrival time), from the trip segments of
+        StopTimesTable.segments(). Segments arriving before they leave are dropped.
+        """
+        from_stops, to_stops, departure_times, arrival_times, trips = segments
+        valid = arrival_times >= departure_times
+        order = np.lexsort((arrival_times[valid], departure_times[valid]))
+        return {
+            'departure_times': to_array('i', departure_times[valid][order]),
+            'arrival_times': to_array('i', arrival_times[valid][order]),
+            'departure_stops': to_array('i', from_stops[valid][order]),
+            'arrival_stops': to_array('i', to_stops[valid][order]),
+            'trips': to_array('i', trips[valid][order]),
+        }
+
+    def earliest_arrival(self, sources, goals, departure_time, running_trips=None):
+        """
+        Earliest arrival at any of the goals when leaving from any of the sources (stop indices) at or after
+        departure_time (seconds since the start of the service day). Returns the list of legs, one per trip
+        taken, or None when no goal can be reached.
+        running_trips (1 per trip index running on the service day) restricts the trips that can be boarded;
+        the trips of the previous service day still running after midnight are not considered.
+        """
+        earliest = [INFINITY] * self.stop_count
+        arrival_connection = [NOT_REACHED] * self.stop_count
+        boarding_connection = [NOT_REACHED] * self.stop_count
+        walked_from = [NOT_REACHED] * self.stop_count
+        trip_boarding = [NOT_REACHED] * self.trip_count
+        is_goal = bytearray(self.stop_count)
+        for goal in goals:
+            is_goal[goal] = 1
+
+        best_goal, best_arrival = NOT_REACHED, INFINITY
+        for source in sources:
+            earliest[source] = departure_time
+            if is_goal[source]:
+                return []
+
+        siblings, transfer_seconds = self.siblings, self.transfer_seconds
+        start = bisect_left(self.departure_times, departure_time)
+        scan = zip(self.departure_times[start:], self.arrival_times[start:], self.departure_stops[start:],
+                   self.arrival_stops[start:], self.trips[start:])
+        for index, (connection_departure, connection_arrival, from_stop, to_stop, trip) in enumerate(scan, start):
+            if connection_departure >= best_arrival:
+                break
+            if trip_boarding[trip] == NOT_REACHED:
+                if earliest[from_stop] > connection_departure:
+                    continue
+                if running_trips is not None and not running_trips[trip]:
+                    continue
+                trip_boarding[trip] = index
+            if connection_arrival >= earliest[to_stop]:
+                continue
+
+            earliest[to_stop] = connection_arrival
+            arrival_connection[to_stop] = index
+            boarding_connection[to_stop] = trip_boarding[trip]
+            if is_goal[to_stop] and connection_arrival < best_arrival:
+                best_goal, best_arrival = to_stop, connection_arrival
+            for sibling in siblings.get(to_stop, ()):
+                transfer_arrival = connection_arrival + transfer_seconds
+                if transfer_arrival < earliest[sibling]:
+                    earliest[sibling] = transfer_arrival
+                    arrival_connection[sibling] = WALKED
+                    walked_from[sibling] = to_stop
+                    if is_goal[sibling] and transfer_arrival < best_arrival:
+                        best_goal, best_arrival = sibling, transfer_arrival
+
+        if best_goal == NOT_REACHED:
+            return None
+        return self.rebuild_legs(best_goal, arrival_connection, boarding_connection, walked_from)
+
+    def rebuild_legs(self, stop, arrival_connection, boarding_connection, walked_from):
+        legs = []
+        while arrival_connection[stop] != NOT_REACHED:
+            if arrival_connection[stop] == WALKED:
+                stop = walked_from[stop]
+                continue
+            alighting, boarding = arrival_connection[stop], boarding_connection[stop]
+            legs.append(Leg(self.trips[alighting], self.departure_stops[boarding], self.departure_times[boarding],
+                            stop, self.arrival_times[alighting]))
+            stop = self.departure_stops[boarding]
+        legs.reverse()
+        return legs
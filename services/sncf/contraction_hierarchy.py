@@ -0,0 +1,328 @@
+import hashlib
+import heapq
+import logging
+import time
+from array import array
+
+from services.sncf.compiled_feed import CompiledFeed, CompiledFeedError, file_lock
+
+"""
+Contraction hierarchies (CH) over the static RouteGraph, for fast station-to-station queries.
+
+Preprocessing contracts the stops one by one, least important first (fewest shortcuts added, fewest contracted
+neighbours): when a stop is removed, a shortcut edge is added between two of its neighbours unless a witness path
+avoiding it is at least as short. Every stop gets a rank, its contraction order, and each edge (original or shortcut)
+is kept once, on its lower ranked end: the "up" edges of a stop go to higher ranked stops, its "down" edges come from
+higher ranked stops. A shortcut remembers the stop it bypasses, so that it can be unpacked into the original edges.
+
+A query runs two Dijkstra searches that only climb the hierarchy, forward over the up edges from the sources and
+backward over the down edges from the goals, and settles a few hundred stops at most. The result is the same route
+cost as a Dijkstra over the whole graph, whose edges have no negative weight (see RouteGraph.from_segments).
+
+The hierarchy is stored next to the compiled feed, with the digest of the graph it was built from, and is rebuilt
+when the graph changes.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Bump when the content or the meaning of the stored sections changes
+CH_VERSION = 1
+INFINITY = float('inf')
+NO_MIDDLE = -1  # Original edge of the graph
+NO_PREDECESSOR = -1
+# Stops a witness search may settle before giving up; a shortcut is then added, which is never wrong
+WITNESS_SETTLE_LIMIT = 500
+SECTIONS = ('ranks', 'up_indptr', 'up_indices', 'up_weights', 'up_middles',
+            'down_indptr', 'down_indices', 'down_weights', 'down_middles')
+
+
+class ContractionHierarchy:
+    def __init__(self, ranks, up_indptr, up_indices, up_weights, up_middles,
+                 down_indptr, down_indices, down_weights, down_middles):
+        """
+        The up edges of stop i are up_indices[up_indptr[i]:up_indptr[i + 1]] (edges i -> j, rank j > rank i),
+        its down edges down_indices[down_indptr[i]:down_indptr[i + 1]] (edges j -> i, rank j > rank i).
+        The middles give the stop bypassed by each shortcut, NO_MIDDLE for the original edges.
+        """
+        self.ranks = ranks
+        self.up_indptr = up_indptr
+        self.up_indices = up_indices
+        self.up_weights = up_weights
+        self.up_middles = up_middles
+        self.down_indptr = down_indptr
+        self.down_indices = down_indices
+        self.down_weights = down_weights
+        self.down_middles = down_middles
+
+    @property
+    def shortcut_count(self):
+        return sum(middle != NO_MIDDLE for middle in self.up_middles) + \
+            sum(middle != NO_MIDDLE for middle in self.down_middles)
+
+    @classmethod
+    def load(cls, path, graph):
+        """
+        Opens the hierarchy stored at path, building (and storing) it first if it is missing or was built from
+        another graph. Concurrent processes build it only once.
+        """
+        digest = cls.graph_digest(graph)
+        hierarchy = cls.open_if_fresh(path, digest)
+        if hierarchy is None:
+            with file_lock(path):
+                hierarchy = cls.open_if_fresh(path, digest)
+                if hierarchy is None:
+                    start = time.perf_counter()
+                    hierarchy = cls.build(graph)
+                    hierarchy.write(path, digest)
+                    logger.info(f"Built the contraction hierarchy {path} in {time.perf_counter() - start:.1f} s "
+                                f"({hierarchy.shortcut_count} shortcuts for {graph.edge_count} edges)")
+        return hierarchy
+
+    @classmethod
+    def open_if_fresh(cls, path, digest):
+        """
+        Returns the hierarchy stored at path if it was built from the graph of the given digest, otherwise None.
+        """
+        try:
+            feed = CompiledFeed(path)
+        except CompiledFeedError as e:
+            logger.info(f"No usable contraction hierarchy: {e}")
+            return None
+        if feed.metadata.get('ch_version') != CH_VERSION or feed.metadata.get('graph_digest') != digest:
+            logger.info(f"The contraction hierarchy {path} was built from another graph.")
+            return None
+        return cls(*(feed.array(name) for name in SECTIONS))
+
+    def write(self, path, digest):
+        CompiledFeed.write(path, {name: getattr(self, name) for name in SECTIONS}, {
+            'ch_version': CH_VERSION,
+            'graph_digest': digest,
+            'node_count': len(self.ranks),
+            'shortcut_count': self.shortcut_count,
+            'built_at': int(time.time()),
+        })
+
+    @staticmethod
+    def graph_digest(graph):
+        """
+        SHA-256 of the CSR arrays of the graph.
+        """
+        digest = hashlib.sha256()
+        for values in (graph.indptr, graph.indices, graph.weights):
+            digest.update(memoryview(values).cast('B'))
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, graph):
+        """
+        Contracts every stop of the graph. Takes from seconds to minutes, depending on the size of the network.
+        """
+        node_count = len(graph)
+        # {neighbour: (weight, middle)} of the stops not contracted yet
+        outgoing = [{} for _ in range(node_count)]
+        incoming = [{} for _ in range(node_count)]
+        for node in range(node_count):
+            for position in range(graph.indptr[node], graph.indptr[node + 1]):
+                neighbor, weight = graph.indices[position], graph.weights[position]
+                if neighbor != node and weight < outgoing[node].get(neighbor, (INFINITY,))[0]:
+                    outgoing[node][neighbor] = incoming[neighbor][node] = (weight, NO_MIDDLE)
+
+        contracted_neighbors = [0] * node_count
+        queue = [(cls._priority(node, outgoing, incoming, contracted_neighbors), node) for node in range(node_count)]
+        heapq.heapify(queue)
+        ranks = array('i', [0] * node_count)
+        up, down = [None] * node_count, [None] * node_count
+        rank = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            # Lazy update: the priority may have changed since it was pushed
+            shortcuts = cls._shortcuts(node, outgoing, incoming)
+            priority = cls._priority(node, outgoing, incoming, contracted_neighbors, shortcuts)
+            if queue and priority > queue[0][0]:
+                heapq.heappush(queue, (priority, node))
+                continue
+
+            ranks[node] = rank
+            rank += 1
+            for source, target, weight in shortcuts:
+                if weight < outgoing[source].get(target, (INFINITY,))[0]:
+                    outgoing[source][target] = incoming[target][source] = (weight, node)
+            for target in outgoing[node]:
+                del incoming[target][node]
+                contracted_neighbors[target] += 1
+            for source in incoming[node]:
+                del outgoing[source][node]
+                contracted_neighbors[source] += 1
+            # Every remaining neighbour is contracted later, so has a higher rank
+            up[node], down[node] = outgoing[node], incoming[node]
+            outgoing[node], incoming[node] = {}, {}
+
+        return cls(ranks, *cls._to_csr(up), *cls._to_csr(down))
+
+    @staticmethod
+    def _to_csr(adjacency):
+        indptr, indices, weights, middles = array('i', [0]), array('i'), array('i'), array('i')
+        for edges in adjacency:
+            for neighbor in sorted(edges):
+                weight, middle = edges[neighbor]
+                indices.append(neighbor)
+                weights.append(weight)
+                middles.append(middle)
+            indptr.append(len(indices))
+        return indptr, indices, weights, middles
+
+    @classmethod
+    def _priority(cls, node, outgoing, incoming, contracted_neighbors, shortcuts=None):
+        """
+        Edge difference (shortcuts added minus edges removed) plus the number of neighbours already contracted,
+        which spreads the contraction evenly over the network.
+        """
+        if shortcuts is None:
+            shortcuts = cls._shortcuts(node, outgoing, incoming)
+        return len(shortcuts) - len(outgoing[node]) - len(incoming[node]) + contracted_neighbors[node]
+
+    @classmethod
+    def _shortcuts(cls, node, outgoing, incoming):
+        """
+        Shortcuts (source, target, weight) needed to keep the distances when node is removed.
+        """
+        shortcuts = []
+        for source, (in_weight, _) in incoming[node].items():
+            targets = {target: in_weight + out_weight
+                       for target, (out_weight, _) in outgoing[node].items() if target != source}
+            if not targets:
+                continue
+            distances = cls._witness_search(source, node, max(targets.values()), outgoing)
+            for target, weight in targets.items():
+                if distances.get(target, INFINITY) > weight:
+                    shortcuts.append((source, target, weight))
+        return shortcuts
+
+    @staticmethod
+    def _witness_search(source, avoided, max_cost, outgoing):
+        """
+        Distances from source without going through avoided, explored up to max_cost.
+        """
+        distances = {source: 0}
+        queue = [(0, source)]
+        settled_count = 0
+        while queue and settled_count < WITNESS_SETTLE_LIMIT:
+            cost, node = heapq.heappop(queue)
+            if cost > max_cost:
+                break
+            if cost > distances[node]:
+                continue
+            settled_count += 1
+            for neighbor, (weight, _) in outgoing[node].items():
+                new_cost = cost + weight
+                if neighbor != avoided and new_cost < distances.get(neighbor, INFINITY):
+                    distances[neighbor] = new_cost
+                    heapq.heappush(queue, (new_cost, neighbor))
+        return distances
+
+    def shortest_path(self, sources, goals):
+        """
+        Shortest path from any of the sources to any of the goals (stop indices).
+        Returns (cost, path, settled_count): path holds the stop indices of the original graph, None when no goal
+        can be reached.
+        """
+        forward = self._Search(sources, self.up_indptr, self.up_indices, self.up_weights)
+        backward = self._Search(goals, self.down_indptr, self.down_indices, self.down_weights)
+        best_cost, meeting = INFINITY, NO_PREDECESSOR
+        while True:
+            # Both directions are explored alternately, the one with the smallest key first
+            search, other = (forward, backward) if forward.top() <= backward.top() else (backward, forward)
+            if search.top() >= best_cost:
+                break
+            node, cost = search.settle()
+            if node is None:
+                continue
+            other_cost = other.distances.get(node)
+            if other_cost is not None and cost + other_cost < best_cost:
+                best_cost, meeting = cost + other_cost, node
+
+        settled_count = forward.settled_count + backward.settled_count
+        if meeting == NO_PREDECESSOR:
+            return INFINITY, None, settled_count
+
+        # Edges from a source up to the meeting stop, then from the meeting stop down to a goal
+        edges = []
+        node = meeting
+        while node in forward.predecessors:
+            previous, position = forward.predecessors[node]
+            edges.append((previous, node, self.up_middles[position]))
+            node = previous
+        edges.reverse()
+        path = [node]
+        node = meeting
+        while node in backward.predecessors:
+            following, position = backward.predecessors[node]
+            edges.append((node, following, self.down_middles[position]))
+            node = following
+        for source, target, middle in edges:
+            self.unpack(source, target, middle, path)
+        return best_cost, path, settled_count
+
+    def unpack(self, source, target, middle, path):
+        """
+        Appends to path the stops of the original graph after source, up to target, along the edge source -> target.
+        """
+        stack = [(source, target, middle)]
+        while stack:
+            source, target, middle = stack.pop()
+            if middle == NO_MIDDLE:
+                path.append(target)
+                continue
+            # The bypassed stop was contracted before both ends: source -> middle is one of its down edges,
+            # middle -> target one of its up edges
+            stack.append((middle, target, self._middle(self.up_indptr, self.up_indices, self.up_middles, middle,
+                                                       target)))
+            stack.append((source, middle, self._middle(self.down_indptr, self.down_indices, self.down_middles,
+                                                       middle, source)))
+
+    @staticmethod
+    def _middle(indptr, indices, middles, node, neighbor):
+        for position in range(indptr[node], indptr[node + 1]):
+            if indices[position] == neighbor:
+                return middles[position]
+        raise ValueError(f"Inconsistent contraction hierarchy: no edge between {node} and {neighbor}.")
+
+    class _Search:
+        """
+        One direction of the query: a Dijkstra over the up (forward) or down (backward) edges.
+        """
+
+        def __init__(self, sources, indptr, indices, weights):
+            self.indptr, self.indices, self.weights = indptr, indices, weights
+            self.distances = {source: 0 for source in sources}
+            self.predecessors = {}
+            self.queue = [(0, source) for source in self.distances]
+            heapq.heapify(self.queue)
+            self.settled_count = 0
+
+        def top(self):
+            return self.queue[0][0] if self.queue else INFINITY
+
+        def settle(self):
+            """
+            Settles the next stop and relaxes its edges. Returns (node, cost), (None, None) for an outdated entry.
+            """
+            cost, node = heapq.heappop(self.queue)
+            if cost > self.distances[node]:
+                return None, None
+            self.settled_count += 1
+            for position in range(self.indptr[node], self.indptr[node + 1]):
+                neighbor = self.indices[position]
+                new_cost = cost + self.weights[position]
+                if new_cost < self.distances.get(neighbor, INFINITY):
+                    self.distances[neighbor] = new_cost
+                    self.predecessors[neighbor] = (node, position)
+                    heapq.heappush(self.queue, (new_cost, neighbor))
+            return node, cost
+
+
+if __name__ == '__main__':
+    # Imported here, the route finder itself imports this module
+    from services.sncf.sncf_route_finder import SNCFRouteFinder, CONTRACTION_HIERARCHY_PATH
+    logging.basicConfig(level=logging.INFO)
+    SNCFRouteFinder(contraction_hierarchy_path=CONTRACTION_HIERARCHY_PATH)
@@ -0,0 +1,59 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+"""
+SciPy backend for the route graph: the CSR arrays of RouteGraph are wrapped (without copy of the structure) into a
+scipy.sparse.csr_matrix, and shortest paths are computed by scipy.sparse.csgraph.dijkstra, in C. Meant for batch
+computations (many-to-many travel times between stations) where the pure Python heap loop is far too slow.
+"""
+
+NO_PREDECESSOR = -9999  # Value used by scipy.sparse.csgraph for unreachable nodes and sources
+
+
+class CSGraphBackend:
+    def __init__(self, graph):
+        self.graph = graph
+        node_count = len(graph)
+        weights = np.frombuffer(graph.weights, dtype=np.int32).astype(np.float64)
+        # Zero weight edges are kept: csgraph treats the explicit entries of a sparse matrix as edges
+        self.matrix = csr_matrix((weights, np.frombuffer(graph.indices, dtype=np.int32),
+                                  np.frombuffer(graph.indptr, dtype=np.int32)), shape=(node_count, node_count))
+
+    def distance_matrix(self, sources, targets=None):
+        """
+        Runs one csgraph Dijkstra from every source (stop indices) in a single call.
+        Returns (distances, predecessors): distances[i, j] is the travel time in minutes from sources[i] to
+        targets[j] (to every stop when targets is None, inf when unreachable), and predecessors[i] is the
+        predecessor row of sources[i] over all the stops.
+        """
+        distances, predecessors = dijkstra(self.matrix, directed=True, indices=list(sources), return_predecessors=True)
+        if targets is not None:
+            distances = distances[:, list(targets)]
+        return distances, predecessors
+
+    def shortest_path(self, sources, goals):
+        """
+        Shortest path from any of the sources to any of the goals, with a single multi-source csgraph call.
+        Returns (cost, path, reached_count): path is None when no goal can be reached.
+        """
+        distances, predecessors, _ = dijkstra(self.matrix, directed=True, indices=list(set(sources)),
+                                              return_predecessors=True, min_only=True)
+        goals = np.asarray(list(goals), dtype=np.int64)
+        reached_count = int(np.isfinite(distances).sum())
+        if not len(goals) or not np.isfinite(distances[goals]).any():
+            return float('inf'), None, reached_count
+        goal = int(goals[np.argmin(distances[goals])])
+        return int(distances[goal]), self.rebuild_path(predecessors, goal), reached_count
+
+    @staticmethod
+    def rebuild_path(predecessors, node):
+        """
+        Path (stop indices) to node from a predecessor row of csgraph.
+        """
+        path = []
+        while node != NO_PREDECESSOR:
+            path.append(int(node))
+            node = predecessors[node]
+        path.reverse()
+        return path
@@ -0,0 +1,167 @@
+import csv
+import logging
+import os
+
+import numpy as np
+
+from services.sncf.stop_name_index import StopNameIndex
+
+"""
+Typo tolerant index over a list of names (cities, words of the stop names), to resolve a misspelled name such as
+"Montpelier" to the known ones within a small edit distance.
+
+Names are normalized like the stop names (StopNameIndex.normalize) and indexed by their trigrams. A name within k
+edits of the query shares at least (number of distinct trigrams of the query) - 3k of them (an edit changes at most
+3 trigrams), so only the names reaching that count are candidates; their exact Levenshtein distance is then
+computed, with a bit-parallel algorithm and an early exit past the bound. A lookup among the ~33,000 city names
+costs about half a millisecond for a 2-edit query ("Montpelier", "Saint-Etiene"), less for shorter ones, instead of
+one edit distance per name.
+"""
+
+logger = logging.getLogger(__name__)
+
+CITY_NAMES_PATH = 'datasets/city.csv'
+_GRAM = 3
+_PADDING = ' ' * (_GRAM - 1)
+
+
+def max_edit_distance(length):
+    """
+    Edits tolerated for a query of the given length: none for the short names, where a single edit already gives
+    another real name ("Metz" / "Mens"), then 1, and 2 from 9 characters.
+    """
+    if length <= 4:
+        return 0
+    return 1 if length <= 8 else 2
+
+
+def trigrams(text):
+    padded = f"{_PADDING}{text}{_PADDING}"
+    return {padded[index:index + _GRAM] for index in range(len(padded) - _GRAM + 1)}
+
+
+def char_masks(text):
+    """
+    Bit mask of the positions of every character of the text, for bounded_levenshtein.
+    """
+    masks = {}
+    for position, char in enumerate(text):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    return masks
+
+
+def bounded_levenshtein(first, second, bound, first_masks=None):
+    """
+    Levenshtein distance between the two strings, or bound + 1 as soon as it is known to exceed bound.
+    The columns of the distance matrix are computed as bit vectors (Myers / Hyyrö bit-parallel algorithm), one step
+    per character of second; first_masks, the char_masks of first, can be given when first is compared many times.
+    """
+    if abs(len(first) - len(second)) > bound:
+        return bound + 1
+    if not first:
+        return len(second)
+    if first_masks is None:
+        first_masks = char_masks(first)
+    full = (1 << len(first)) - 1
+    last = 1 << (len(first) - 1)
+    # Vertical deltas (+1 / -1) of the current column, and its last cell: the distance between first and the
+    # prefix of second read so far
+    plus, minus, distance = full, 0, len(first)
+    for column, char in enumerate(second, 1):
+        equal = first_masks.get(char, 0)
+        vertical = equal | minus
+        horizontal = (((equal & plus) + plus) ^ plus) | equal
+        horizontal_plus = minus | (~(horizontal | plus) & full)
+        horizontal_minus = plus & horizontal
+        if horizontal_plus & last:
+            distance += 1
+        elif horizontal_minus & last:
+            distance -= 1
+        # The distance decreases by at most 1 per character left
+        if distance - (len(second) - column) > bound:
+            return bound + 1
+        horizontal_plus = ((horizontal_plus << 1) | 1) & full
+        horizontal_minus = (horizontal_minus << 1) & full
+        plus = horizontal_minus | (~(vertical | horizontal_plus) & full)
+        minus = horizontal_plus & vertical
+    return min(distance, bound + 1)
+
+
+class FuzzyNameIndex:
+    def __init__(self, names):
+        """
+        names is an iterable of names; the first spelling of every normalized name is kept as its canonical name.
+        """
+        self.canonical_names = {}
+        for name in names:
+            self.canonical_names.setdefault(StopNameIndex.normalize(name), name)
+        self._normalized_names = list(self.canonical_names)
+        self._lengths = np.array([len(name) for name in self._normalized_names], dtype=np.int32)
+
+        postings = {}
+        for name_id, name in enumerate(self._normalized_names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(name_id)
+        self._postings = {gram: np.array(name_ids, dtype=np.int32) for gram, name_ids in postings.items()}
+
+    def __len__(self):
+        return len(self._normalized_names)
+
+    @classmethod
+    def load_cities(cls, path=CITY_NAMES_PATH):
+        """
+        Index of the city names of datasets/city.csv (empty when the file is missing).
+        """
+        if not os.path.exists(path):
+            logger.warning(f"No city file at {path}, city names cannot be corrected.")
+            return cls([])
+        with open(path, mode='r', encoding='utf-8') as file:
+            return cls(row['city'] for row in csv.DictReader(file))
+
+    def search(self, query, max_distance=None, limit=5):
+        """
+        The (up to) limit names closest to the query, within max_distance edits of its normalized form
+        (max_edit_distance of its length by default). Returns (canonical name, distance) tuples, best first:
+        by distance, then by number of shared trigrams.
+        """
+        query = StopNameIndex.normalize(query)
+        if not query:
+            return []
+        if max_distance is None:
+            max_distance = max_edit_distance(len(query))
+        if query in self.canonical_names and (max_distance == 0 or limit == 1):
+            return [(self.canonical_names[query], 0)]
+        if max_distance == 0:
+            return []
+
+        grams = trigrams(query)
+        threshold = max(1, len(grams) - _GRAM * max_distance)
+        postings = [self._postings[gram] for gram in grams if gram in self._postings]
+        if len(postings) < threshold:
+            return []
+        shared = np.bincount(np.concatenate(postings), minlength=len(self._normalized_names))
+        candidates = np.flatnonzero((shared >= threshold) & (np.abs(self._lengths - len(query)) <= max_distance))
+
+        ranked = []
+        query_masks = char_masks(query)
+        for name_id in candidates.tolist():
+            name = self._normalized_names[name_id]
+            distance = bounded_levenshtein(query, name, max_distance, query_masks)
+            if distance <= max_distance:
+                ranked.append((distance, -int(shared[name_id]), name))
+        ranked.sort()
+        return [(self.canonical_names[name], distance) for distance, _, name in ranked[:limit]]
+
+    def best(self, query, max_distance=None):
+        """
+        The canonical name closest to the query (see search), or None.
+        """
+        results = self.search(query, max_distance, limit=1)
+        return results[0][0] if results else None
+
+    def snap(self, name):
+        """
+        Replaces a name (e.g. a city extracted from a sentence) by its canonical spelling, the closest known name,
+        or keeps it when no known name is close enough.
+        """
+        return self.best(name) or name
@@ -0,0 +1,247 @@
+import hashlib
+import logging
+import os
+import time
+from array import array
+
+from services.sncf.compiled_feed import CompiledFeed, CompiledFeedError, file_lock
+from services.sncf.connection_scan import ConnectionScan
+from services.sncf.service_calendar import ServiceCalendar
+from services.sncf.stop_times_table import StopTimesTable
+
+"""
+Compiles the GTFS directory (assets/data_sncf) into a single binary artifact that SNCFRouteFinder opens with mmap:
+integer stop indices, the stop table and the route graph as CSR adjacency arrays with precomputed edge weights (and
+the trip achieving each of them), plus the timetable connections sorted by departure time for the Connection Scan
+engine, the day bitsets of the service calendar and the stop_times columns with their per-stop indexes.
+The artifact records the hash of every source file and is rebuilt automatically when one of them changes. A rebuild
+starts from the previous artifact: the calendar bitsets are kept when the calendar files did not change, and only
+the trips whose stop times changed are parsed again (see StopTimesTable.load_incremental).
+"""
+
+logger = logging.getLogger(__name__)
+
+# Bump when the content or the meaning of the compiled sections changes
+GRAPH_VERSION = 14
+SOURCE_FILES = ("stops.txt", "routes.txt", "trips.txt", "stop_times.txt", "calendar.txt", "calendar_dates.txt")
+# Processes parsing stop_times.txt when the feed is compiled from scratch (see StopTimesTable.load_parallel)
+BUILD_WORKERS = int(os.environ.get("SNCF_BUILD_WORKERS", "1"))
+
+
+class GTFSCompiler:
+    def __init__(self, data_dir='assets/data_sncf', compiled_path='assets/compiled/sncf_feed.bin', workers=None):
+        """
+        workers is the number of processes parsing stop_times.txt (BUILD_WORKERS, from the SNCF_BUILD_WORKERS
+        environment variable, by default); the compiled feed is the same whatever their number.
+        """
+        self.data_dir = data_dir
+        self.compiled_path = compiled_path
+        self.workers = BUILD_WORKERS if workers is None else workers
+
+    def load(self):
+        """
+        Returns the compiled feed, compiling it first if it is missing or stale.
+        When several processes start together (the API workers), the first one compiles the feed while the others
+        wait for it, then they all map the same file.
+        """
+        feed = self.open_if_fresh()
+        if feed is None:
+            with file_lock(self.compiled_path):
+                feed = self.open_if_fresh()
+                if feed is None:
+                    self.compile()
+                    feed = CompiledFeed(self.compiled_path)
+        return feed
+
+    def open_if_fresh(self):
+        """
+        Returns the compiled feed if it exists and matches the sources, otherwise None.
+        """
+        feed = self.open_previous()
+        if feed is None:
+            return None
+        if not self.sources_match(feed.source_hashes):
+            logger.info(f"The GTFS sources in {self.data_dir} changed, the compiled feed is stale.")
+            return None
+        return feed
+
+    def open_previous(self):
+        """
+        Returns the compiled feed if it exists and was compiled in the current format, whatever its sources.
+        """
+        if not os.path.exists(self.compiled_path):
+            return None
+        try:
+            feed = CompiledFeed(self.compiled_path)
+        except CompiledFeedError as e:
+            logger.info(f"Ignoring the compiled feed: {e}")
+            return None
+        if feed.metadata.get('graph_version') != GRAPH_VERSION:
+            return None
+        return feed
+
+    def sources_match(self, recorded):
+        """
+        Checks the sources against the recorded fingerprints. Files with an unchanged size and mtime are
+        trusted without being read; the others are hashed, so touching a file does not force a rebuild.
+        """
+        if set(recorded) != set(SOURCE_FILES):
+            return False
+        for file_name in SOURCE_FILES:
+            file_path = os.path.join(self.data_dir, file_name)
+            if not os.path.exists(file_path):
+                return False
+            stat = os.stat(file_path)
+            fingerprint = recorded[file_name]
+            if stat.st_size == fingerprint['size'] and stat.st_mtime_ns == fingerprint['mtime_ns']:
+                continue
+            if stat.st_size != fingerprint['size'] or self.hash_file(file_path) != fingerprint['sha256']:
+                return False
+        return True
+
+    def source_signature(self):
+        """
+        (size, mtime_ns) of every source file, None for the missing ones: cheap to poll to detect a feed update.
+        """
+        signature = []
+        for file_name in SOURCE_FILES:
+            try:
+                stat = os.stat(os.path.join(self.data_dir, file_name))
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def source_fingerprints(self):
+        fingerprints = {}
+        for file_name in SOURCE_FILES:
+            file_path = os.path.join(self.data_dir, file_name)
+            stat = os.stat(file_path)
+            fingerprints[file_name] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': self.hash_file(file_path),
+            }
+        return fingerprints
+
+    @staticmethod
+    def hash_file(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, mode='rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def compile(self, incremental=True):
+        """
+        Parses the GTFS files, builds the route graph and writes the compiled artifact.
+        When incremental, what did not change since the previous artifact is reused from it.
+        """
+        start = time.perf_counter()
+        fingerprints = self.source_fingerprints()
+        sections, metadata = self.build(fingerprints, self.open_previous() if incremental else None)
+        CompiledFeed.write(self.compiled_path, sections, metadata, fingerprints)
+        logger.info(f"Compiled {self.data_dir} into {self.compiled_path} in {time.perf_counter() - start:.1f} s "
+                    f"({metadata['node_count']} stops, {metadata['edge_count']} edges for "
+                    f"{metadata['segment_count']} trip segments)")
+
+    @staticmethod
+    def unchanged(feed, fingerprints, file_names):
+        """
+        True if the files have the same content as when the feed was compiled.
+        """
+        return all(feed.source_hashes.get(file_name, {}).get('sha256') == fingerprints[file_name]['sha256']
+                   for file_name in file_names)
+
+    @staticmethod
+    def feed_version(fingerprints):
+        """
+        Identifier of the feed content: a digest of the hashes of the source files and of the graph version.
+        """
+        digest = hashlib.sha256(str(GRAPH_VERSION).encode('utf-8'))
+        for file_name in SOURCE_FILES:
+            digest.update(fingerprints[file_name]['sha256'].encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def build(self, fingerprints=None, previous=None):
+        """
+        Parses the GTFS files and builds every section of the compiled feed, in memory.
+        previous is an earlier compiled feed to reuse the unchanged parts from. Returns (sections, metadata).
+        """
+        # Imported here, the route finder itself imports this module
+        from services.sncf.sncf_route_finder import SNCFRouteFinder, NO_ROUTE
+
+        stops = SNCFRouteFinder.load_stops(self.data_dir)
+        routes = SNCFRouteFinder.load_routes(self.data_dir)
+        trips = SNCFRouteFinder.load_trips(self.data_dir)
+        fingerprints = fingerprints or self.source_fingerprints()
+        stop_times = SNCFRouteFinder.load_stop_times(self.data_dir, stops,
+                                                     StopTimesTable.from_feed(previous) if previous else None,
+                                                     self.workers)
+        if previous and self.unchanged(previous, fingerprints, ('calendar.txt', 'calendar_dates.txt')):
+            service_calendar = ServiceCalendar.from_feed(previous)
+        else:
+            service_calendar = ServiceCalendar.load(self.data_dir)
+        parents = SNCFRouteFinder.load_stop_parents(self.data_dir)
+
+        route_index = {route_id: index for index, route_id in enumerate(routes)}
+        segments = stop_times.segments()
+        graph = SNCFRouteFinder.build_graph(stops, stop_times, segments)
+        connections = ConnectionScan.build_connections(segments)
+        # Station of every stop: its parent StopArea when it has one, itself otherwise
+        stop_stations = array('i', [graph.stop_index.get(parents.get(stop_id), index)
+                                    for index, stop_id in enumerate(graph.stop_ids)])
+
+        sections = {
+            'stop_ids': graph.stop_ids,
+            'stop_names': stops.names,
+            'stop_lats': graph.latitudes,
+            'stop_lons': graph.longitudes,
+            'route_ids': list(routes),
+            'route_names': list(routes.values()),
+            'graph_indptr': graph.indptr,
+            'graph_indices': graph.indices,
+            'graph_weights': graph.weights,
+            'graph_edge_trips': graph.edge_trips,
+            'stop_stations': stop_stations,
+            'trip_ids': stop_times.trip_ids,
+            'trip_services': service_calendar.trip_services(stop_times.trip_ids, trips),
+            'trip_routes': array('i', [route_index.get(trips.get(trip_id, {}).get('route_id'), NO_ROUTE)
+                                       for trip_id in stop_times.trip_ids]),
+            'trip_headsigns': [trips.get(trip_id, {}).get('trip_headsign', '') for trip_id in stop_times.trip_ids],
+            'calendar_service_ids': service_calendar.service_ids,
+            'calendar_bits': array('B', service_calendar.bits),
+            **{f'connection_{name}': values for name, values in connections.items()},
+            'stop_time_trips': stop_times.trips,
+            'stop_time_stops': stop_times.stops,
+            'stop_time_arrival_times': stop_times.arrival_times,
+            'stop_time_departure_times': stop_times.departure_times,
+            'stop_time_stop_sequences': stop_times.stop_sequences,
+            'stop_time_stop_row_indptr': stop_times.stop_row_indptr,
+            'stop_time_stop_rows': stop_times.stop_rows,
+            'stop_time_trip_hashes': stop_times.trip_hashes,
+            'stop_time_departure_indptr': stop_times.departure_indptr,
+            'stop_time_departure_rows': stop_times.departure_rows,
+            'stop_time_trip_row_indptr': stop_times.trip_row_indptr,
+            'stop_time_trip_rows': stop_times.trip_rows,
+        }
+        metadata = {
+            'graph_version': GRAPH_VERSION,
+            'feed_version': self.feed_version(fingerprints),
+            'stop_count': stops.stop_count,
+            'node_count': len(graph),
+            'edge_count': graph.edge_count,
+            'segment_count': len(segments[0]),
+            'connection_count': len(connections['trips']),
+            'stop_time_count': len(stop_times),
+            'calendar_start_date': service_calendar.start_date.strftime('%Y%m%d'),
+            'calendar_day_count': service_calendar.day_count,
+            'max_speed_kmh': graph.max_speed_kmh,
+            'compiled_at': int(time.time()),
+        }
+        return sections, metadata
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    GTFSCompiler().compile()
@@ -0,0 +1,21 @@
+"""
+GTFS times are "HH:MM:SS" counted from the start of the service day: they go past 24:00:00 for the trips
+that end (or start) after midnight. They are handled as seconds since the start of the service day.
+"""
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+def parse_gtfs_time(value):
+    """
+    "25:10:30" -> 90630
+    """
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_gtfs_time(seconds):
+    """
+    90630 -> "25:10:30"
+    """
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
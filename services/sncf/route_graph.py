@@ -0,0 +1,164 @@
+import logging
+
+import numpy as np
+from services.sncf.compiled_feed import to_array
+from services.sncf.geo import haversine_km, haversine_km_arrays
+
+"""
+Static route graph between stops, stored in CSR form: the outgoing edges of the stop at index i are
+indices[indptr[i]:indptr[i + 1]], with the travel time in minutes at the same positions in weights.
+Parallel trip segments between two stops are collapsed into a single edge of minimum weight, and edge_trips
+keeps the trip (index) that achieves it. The coordinates of every stop are kept by index (NaN for the stops
+missing from stops.txt).
+"""
+
+logger = logging.getLogger(__name__)
+
+# Lower bound for the network speed used by A*, above the TGV commercial speed
+MIN_MAX_SPEED_KMH = 320.0
+
+
+class RouteGraph:
+    def __init__(self, stop_ids, indptr, indices, weights, latitudes, longitudes, max_speed_kmh=None,
+                 edge_trips=None, stop_index=None):
+        """
+        stop_index is the {stop_id: index} interning table of stop_ids when the caller already has it (shared with
+        the stop table and the graphs derived from this one).
+        """
+        self.stop_ids = stop_ids
+        self.stop_index = stop_index if stop_index is not None else {
+            stop_id: index for index, stop_id in enumerate(stop_ids)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.edge_trips = edge_trips
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self._max_speed_kmh = max_speed_kmh
+        self._unbounded_stops = None
+
+    @classmethod
+    def from_segments(cls, stop_ids, latitudes, longitudes, from_stops, to_stops, weights, trips,
+                      max_speed_kmh=None, stop_index=None):
+        """
+        Builds the CSR graph in one vectorized pass from the trip segment arrays (stop indices, minutes and trip
+        indices). Segments between the same two stops are collapsed into the one of minimum weight (the first one
+        in input order on ties); the edges of a stop are ordered by destination stop.
+        Segments of negative weight (arriving before they leave) are dropped, like ConnectionScan.build_connections
+        does, so that every search algorithm sees the same non-negative edges.
+        """
+        weights = np.asarray(weights, dtype=np.int32)
+        valid = weights >= 0
+        from_stops = np.asarray(from_stops, dtype=np.int32)[valid]
+        to_stops = np.asarray(to_stops, dtype=np.int32)[valid]
+        weights = weights[valid]
+        trips = np.asarray(trips, dtype=np.int32)[valid]
+        order = np.lexsort((np.arange(len(from_stops)), weights, to_stops, from_stops))
+        from_stops, to_stops, weights, trips = from_stops[order], to_stops[order], weights[order], trips[order]
+        # First segment of every (from, to) pair in the sorted order: the one of minimum weight
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (from_stops[1:] != from_stops[:-1]) | (to_stops[1:] != to_stops[:-1])
+
+        indptr = np.zeros(len(stop_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(from_stops[first], minlength=len(stop_ids)), out=indptr[1:])
+        return cls(stop_ids, to_array('i', indptr), to_array('i', to_stops[first]), to_array('i', weights[first]),
+                   latitudes, longitudes, max_speed_kmh, to_array('i', trips[first]), stop_index)
+
+    @classmethod
+    def from_connections(cls, graph, connection_scan, running_trips):
+        """
+        Builds the graph of the timetable connections whose trip runs (running_trips[trip] == 1), on the stops
+        of graph. Edge weights are computed like build_graph_optimized (minutes between departure and arrival).
+        """
+        trips = np.frombuffer(connection_scan.trips, dtype=np.int32)
+        running = np.frombuffer(running_trips, dtype=np.uint8).astype(bool)[trips] if len(trips) else trips
+        departure_times = np.frombuffer(connection_scan.departure_times, dtype=np.int32)[running]
+        arrival_times = np.frombuffer(connection_scan.arrival_times, dtype=np.int32)[running]
+        return cls.from_segments(graph.stop_ids, graph.latitudes, graph.longitudes,
+                                 np.frombuffer(connection_scan.departure_stops, dtype=np.int32)[running],
+                                 np.frombuffer(connection_scan.arrival_stops, dtype=np.int32)[running],
+                                 arrival_times // 60 - departure_times // 60,
+                                 np.frombuffer(connection_scan.trips, dtype=np.int32)[running], graph.max_speed_kmh,
+                                 graph.stop_index)
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @property
+    def max_speed_kmh(self):
+        """
+        Highest straight-line speed over the edges of the graph (never below MIN_MAX_SPEED_KMH), so that
+        the distance to the goal divided by this speed never overestimates the remaining travel time of a route
+        through bounded edges. The edges that no speed bounds are left out, see unbounded_stops.
+        """
+        if self._max_speed_kmh is None:
+            self._bound_edges()
+        return self._max_speed_kmh
+
+    @property
+    def unbounded_stops(self):
+        """
+        Stops (indices, with coordinates) leaving through an edge that no speed bounds: 0 minutes between two
+        distinct positions, or towards a stop without coordinates. A route taking such an edge costs at least the
+        travel time to its first stop, so A* estimates the distance to the closest goal or unbounded stop.
+        """
+        if self._unbounded_stops is None:
+            self._bound_edges()
+        return self._unbounded_stops
+
+    def _bound_edges(self):
+        indptr = np.frombuffer(self.indptr, dtype=np.int32)
+        sources = np.repeat(np.arange(len(self.stop_ids), dtype=np.int32), np.diff(indptr))
+        targets = np.frombuffer(self.indices, dtype=np.int32)
+        weights = np.frombuffer(self.weights, dtype=np.int32)
+        latitudes = np.asarray(self.latitudes, dtype=np.float64)
+        longitudes = np.asarray(self.longitudes, dtype=np.float64)
+        distances = haversine_km_arrays(latitudes[sources], longitudes[sources], latitudes[targets],
+                                        longitudes[targets])
+        with np.errstate(invalid='ignore'):
+            unbounded = np.isnan(distances) | ((weights == 0) & (distances > 0))
+            bounded = ~unbounded & (weights > 0)
+        if self._max_speed_kmh is None:
+            speeds = distances[bounded] / weights[bounded] * 60
+            self._max_speed_kmh = max(MIN_MAX_SPEED_KMH, float(speeds.max()) if len(speeds) else 0.0)
+        self._unbounded_stops = np.unique(sources[unbounded & ~np.isnan(latitudes[sources])])
+        if np.count_nonzero(unbounded):
+            logger.warning(f"{np.count_nonzero(unbounded)} edges of the route graph have no speed bound (0 minutes "
+                           f"between distinct stops, or a stop without coordinates), A* estimates the distance to "
+                           f"their {len(self._unbounded_stops)} departure stops")
+
+    def distance_km(self, node, other):
+        """
+        Great-circle distance between two stop indices, NaN when one of them has no coordinates.
+        """
+        return haversine_km(self.latitudes[node], self.longitudes[node], self.latitudes[other], self.longitudes[other])
+
+    def edge_position(self, node, neighbor):
+        """
+        Position of the edge node -> neighbor in the CSR arrays, or None when there is no such edge.
+        """
+        for position in range(self.indptr[node], self.indptr[node + 1]):
+            if self.indices[position] == neighbor:
+                return position
+        return None
+
+    def indices_of(self, stop_ids):
+        """
+        Converts stop ids to stop indices, skipping the stops that are not in the graph.
+        """
+        return [self.stop_index[stop_id] for stop_id in stop_ids if stop_id in self.stop_index]
+
+    def get(self, stop_id, default=None):
+        """
+        Returns the outgoing edges of a stop as (next_stop_id, minutes) tuples, like the former dict graph.
+        """
+        index = self.stop_index.get(stop_id)
+        if index is None:
+            return default
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return [(self.stop_ids[neighbor], weight)
+                for neighbor, weight in zip(self.indices[start:end], self.weights[start:end])]
@@ -0,0 +1,251 @@
+import heapq
+from array import array
+from typing import NamedTuple
+from services.sncf.geo import haversine_km
+
+"""
+Shortest path search over the CSR RouteGraph, on integer stop indices.
+
+The search keeps one flat distance array and one predecessor array instead of pushing a copy of the path with
+every heap entry; the path is only rebuilt once, from the predecessors, when the goal is settled.
+
+Two algorithms are available:
+- "dijkstra": explores the network radially from the sources.
+- "astar": A* guided by the great-circle distance to the closest goal divided by the maximum network speed.
+  This never overestimates the remaining travel time, so the route found is still the shortest one,
+  while far fewer stops are settled.
+- "csgraph": the whole search runs in C with scipy.sparse.csgraph (see csgraph_backend), settled_count is then the
+  number of stops reached.
+- "ch": bidirectional upward search in the contraction hierarchy of the graph (see contraction_hierarchy), when the
+  finder has one.
+"""
+
+INFINITY = float('inf')
+NO_PREDECESSOR = -1
+DIJKSTRA = "dijkstra"
+ASTAR = "astar"
+CSGRAPH = "csgraph"
+CONTRACTION_HIERARCHY = "ch"
+ALGORITHMS = (DIJKSTRA, ASTAR, CSGRAPH, CONTRACTION_HIERARCHY)
+
+
+class SearchResult(NamedTuple):
+    cost: float
+    path: list  # Stop indices, None when no goal can be reached
+    settled_count: int
+    trip: int | None = None  # Trip index when the route is a single direct train (SNCFRouteFinder.search_route)
+
+
+class Reachability(NamedTuple):
+    stops: array  # Stop indices reached within the budget, by increasing cost
+    costs: array  # Travel time to each of them
+
+
+class RouteSearch:
+    def __init__(self, graph, contraction_hierarchy=None):
+        self.graph = graph
+        self.contraction_hierarchy = contraction_hierarchy
+        self._csgraph_backend = None
+        self._unbounded_tree = None
+
+    @property
+    def csgraph_backend(self):
+        """
+        SciPy backend over the same graph, built on first use (scipy is only imported then).
+        """
+        if self._csgraph_backend is None:
+            from services.sncf.csgraph_backend import CSGraphBackend
+            self._csgraph_backend = CSGraphBackend(self.graph)
+        return self._csgraph_backend
+
+    @property
+    def unbounded_tree(self):
+        """
+        StopSpatialIndex over graph.unbounded_stops (each one taken as its own station), built on first use (scipy
+        is only imported then). None when every edge of the graph is bounded.
+        """
+        if self._unbounded_tree is None and len(self.graph.unbounded_stops):
+            from services.sncf.stop_spatial_index import StopSpatialIndex
+            self._unbounded_tree = StopSpatialIndex(self.graph.latitudes, self.graph.longitudes,
+                                                    self.graph.unbounded_stops)
+        return self._unbounded_tree
+
+    def shortest_path(self, sources, goals, algorithm=DIJKSTRA):
+        """
+        Shortest path from any of the sources to any of the goals (stop indices).
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown search algorithm '{algorithm}', expected one of {ALGORITHMS}.")
+        if algorithm == CSGRAPH:
+            return SearchResult(*self.csgraph_backend.shortest_path(sources, goals))
+        if algorithm == CONTRACTION_HIERARCHY:
+            if self.contraction_hierarchy is None:
+                raise ValueError("No contraction hierarchy was loaded for this graph.")
+            return SearchResult(*self.contraction_hierarchy.shortest_path(sources, goals))
+
+        indptr, indices, weights = self.graph.indptr, self.graph.indices, self.graph.weights
+        node_count = len(self.graph)
+        distances = [INFINITY] * node_count
+        predecessors = [NO_PREDECESSOR] * node_count
+        settled = bytearray(node_count)
+        is_goal = bytearray(node_count)
+        for goal in goals:
+            is_goal[goal] = 1
+        heuristic = self.goal_distance_heuristic(goals) if algorithm == ASTAR else None
+
+        queue = []
+        for source in set(sources):
+            distances[source] = 0
+            queue.append((heuristic(source) if heuristic else 0, source))
+        heapq.heapify(queue)
+        settled_count = 0
+
+        while queue:
+            _, node = heapq.heappop(queue)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            settled_count += 1
+            cost = distances[node]
+
+            if is_goal[node]:
+                return SearchResult(cost, self.rebuild_path(predecessors, node), settled_count)
+
+            start, end = indptr[node], indptr[node + 1]
+            for neighbor, weight in zip(indices[start:end], weights[start:end]):
+                new_cost = cost + weight
+                if new_cost < distances[neighbor] and not settled[neighbor]:
+                    distances[neighbor] = new_cost
+                    predecessors[neighbor] = node
+                    priority = new_cost + heuristic(neighbor) if heuristic else new_cost
+                    heapq.heappush(queue, (priority, neighbor))
+
+        return SearchResult(INFINITY, None, settled_count)
+
+    def shortest_path_tree(self, sources, goal_sets):
+        """
+        One-to-many search: grows a single Dijkstra tree from the sources (stop indices) until each of the goal
+        sets (one list of stop indices per destination) has a settled stop. Returns one SearchResult per goal set,
+        identical to the result of shortest_path(sources, goals) with Dijkstra for that set.
+        """
+        indptr, indices, weights = self.graph.indptr, self.graph.indices, self.graph.weights
+        node_count = len(self.graph)
+        distances = [INFINITY] * node_count
+        predecessors = [NO_PREDECESSOR] * node_count
+        settled = bytearray(node_count)
+        results = [SearchResult(INFINITY, None, 0)] * len(goal_sets)
+        # Goal sets (positions) waiting for each stop
+        waiting = {}
+        for position, goals in enumerate(goal_sets):
+            for goal in set(goals):
+                waiting.setdefault(goal, []).append(position)
+        remaining = sum(1 for goals in goal_sets if goals)
+
+        queue = []
+        for source in set(sources):
+            distances[source] = 0
+            queue.append((0, source))
+        heapq.heapify(queue)
+        settled_count = 0
+
+        while queue and remaining:
+            _, node = heapq.heappop(queue)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            settled_count += 1
+            cost = distances[node]
+
+            for position in waiting.pop(node, ()):
+                if results[position].path is None:
+                    results[position] = SearchResult(cost, self.rebuild_path(predecessors, node), settled_count)
+                    remaining -= 1
+
+            start, end = indptr[node], indptr[node + 1]
+            for neighbor, weight in zip(indices[start:end], weights[start:end]):
+                new_cost = cost + weight
+                if new_cost < distances[neighbor] and not settled[neighbor]:
+                    distances[neighbor] = new_cost
+                    predecessors[neighbor] = node
+                    heapq.heappush(queue, (new_cost, neighbor))
+
+        return [result if result.path is not None else result._replace(settled_count=settled_count)
+                for result in results]
+
+    def reachable(self, sources, max_cost):
+        """
+        Bounded one-to-all search: every stop reachable from the sources within max_cost, with its travel time.
+        Edges leading past the budget are not explored.
+        """
+        indptr, indices, weights = self.graph.indptr, self.graph.indices, self.graph.weights
+        node_count = len(self.graph)
+        distances = [INFINITY] * node_count
+        settled = bytearray(node_count)
+        stops, costs = array('i'), array('i')
+
+        queue = []
+        for source in set(sources):
+            distances[source] = 0
+            queue.append((0, source))
+        heapq.heapify(queue)
+
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if settled[node]:
+                continue
+            settled[node] = 1
+            stops.append(node)
+            costs.append(cost)
+
+            start, end = indptr[node], indptr[node + 1]
+            for neighbor, weight in zip(indices[start:end], weights[start:end]):
+                new_cost = cost + weight
+                if new_cost <= max_cost and new_cost < distances[neighbor] and not settled[neighbor]:
+                    distances[neighbor] = new_cost
+                    heapq.heappush(queue, (new_cost, neighbor))
+
+        return Reachability(stops, costs)
+
+    def goal_distance_heuristic(self, goals):
+        """
+        Returns a function giving, for a stop index, a lower bound in minutes of the travel time to the closest goal.
+        Stops without coordinates get 0, which is still a lower bound (and so does every stop when a goal has none).
+        The distance is taken to the closest goal or stop of graph.unbounded_stops: a route leaving through an edge
+        that the maximum speed does not bound costs at least the travel time to that stop, so the estimate never
+        exceeds the travel time (and never decreases by more than an edge weight along an edge).
+        """
+        graph = self.graph
+        minutes_per_km = 60 / graph.max_speed_kmh
+        # StopAreas and their StopPoints share their coordinates: one distance per distinct position is enough
+        goal_positions = list({(graph.latitudes[goal], graph.longitudes[goal]) for goal in goals})
+        if any(latitude != latitude for latitude, _ in goal_positions):
+            goal_positions = []
+        unbounded_tree = self.unbounded_tree
+        estimates = {}
+
+        def heuristic(node):
+            estimate = estimates.get(node)
+            if estimate is None:
+                latitude, longitude = graph.latitudes[node], graph.longitudes[node]
+                if latitude != latitude or not goal_positions:
+                    estimate = 0
+                else:
+                    distance = min(haversine_km(latitude, longitude, goal_latitude, goal_longitude)
+                                   for goal_latitude, goal_longitude in goal_positions)
+                    if unbounded_tree is not None:
+                        [(_, unbounded_distance)] = unbounded_tree.nearest_stations(latitude, longitude, 1, INFINITY)
+                        distance = min(distance, unbounded_distance)
+                    estimate = distance * minutes_per_km
+                estimates[node] = estimate
+            return estimate
+
+        return heuristic
+
+    @staticmethod
+    def rebuild_path(predecessors, node):
+        path = []
+        while node != NO_PREDECESSOR:
+            path.append(node)
+            node = predecessors[node]
+        path.reverse()
+        return path
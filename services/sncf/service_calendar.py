@@ -0,0 +1,141 @@
+import csv
+import os
+from array import array
+from datetime import date, datetime, timedelta
+
+"""
+Service calendar of the feed, as one day bitset per service.
+
+calendar.txt gives the weekly pattern of every service between its start and end dates, and calendar_dates.txt
+adds (exception_type 1) or removes (exception_type 2) single days. Both are applied once, when the feed is
+compiled, into bitsets covering the whole date range of the feed: "does service X run on date D" is then a
+single bit test.
+"""
+
+SERVICE_ADDED = '1'
+SERVICE_REMOVED = '2'
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+UNKNOWN_SERVICE = -1
+# Number of days whose running trips are kept in memory
+_RUNNING_TRIPS_CACHE_SIZE = 32
+
+
+class ServiceCalendar:
+    def __init__(self, service_ids, start_date, day_count, bits):
+        """
+        bits holds, for every service (in service_ids order), day_count bits starting at start_date,
+        packed in bytes_per_service bytes.
+        """
+        self.service_ids = service_ids
+        self.service_index = {service_id: index for index, service_id in enumerate(service_ids)}
+        self.start_date = start_date
+        self.day_count = day_count
+        self.bytes_per_service = (day_count + 7) // 8
+        self.bits = bits
+        self._running_trips = {}
+
+    @classmethod
+    def from_feed(cls, feed):
+        """
+        Calendar read in place from the calendar_* sections of a compiled feed.
+        """
+        return cls(feed.strings('calendar_service_ids'), cls.parse_date(feed.metadata['calendar_start_date']),
+                   feed.metadata['calendar_day_count'], feed.array('calendar_bits'))
+
+    @classmethod
+    def load(cls, data_dir='assets/data_sncf'):
+        """
+        Parses calendar.txt and calendar_dates.txt into the day bitsets.
+        """
+        weekly = {}
+        with open(os.path.join(data_dir, 'calendar.txt'), mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                weekly[row['service_id']] = (
+                    [row[weekday] == '1' for weekday in WEEKDAYS],
+                    cls.parse_date(row['start_date']),
+                    cls.parse_date(row['end_date']),
+                )
+        exceptions = []
+        with open(os.path.join(data_dir, 'calendar_dates.txt'), mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                exceptions.append((row['service_id'], cls.parse_date(row['date']), row['exception_type']))
+
+        # Ordered set: the services of calendar.txt, then the ones only found in calendar_dates.txt
+        service_ids = dict.fromkeys(weekly)
+        for service_id, _, _ in exceptions:
+            service_ids.setdefault(service_id)
+        service_ids = list(service_ids)
+        dates = [day for _, start, end in weekly.values() for day in (start, end)] + [day for _, day, _ in exceptions]
+        if not dates:
+            return cls(service_ids, date.today(), 0, bytearray())
+
+        start_date = min(dates)
+        calendar = cls(service_ids, start_date, (max(dates) - start_date).days + 1, None)
+        calendar.bits = bytearray(calendar.bytes_per_service * len(service_ids))
+        for service_id, (weekdays, start, end) in weekly.items():
+            service = calendar.service_index[service_id]
+            day = start
+            while day <= end:
+                if weekdays[day.weekday()]:
+                    calendar._set(service, (day - start_date).days, True)
+                day += timedelta(days=1)
+        for service_id, day, exception_type in exceptions:
+            calendar._set(calendar.service_index[service_id], (day - start_date).days,
+                          exception_type == SERVICE_ADDED)
+        return calendar
+
+    @staticmethod
+    def parse_date(value):
+        """
+        Accepts a date, a datetime or a "YYYYMMDD" / "YYYY-MM-DD" string.
+        """
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.strptime(value.replace('-', ''), '%Y%m%d').date()
+
+    def _set(self, service, offset, running):
+        position = service * self.bytes_per_service + (offset >> 3)
+        if running:
+            self.bits[position] |= 1 << (offset & 7)
+        else:
+            self.bits[position] &= ~(1 << (offset & 7)) & 0xFF
+
+    def runs(self, service, day):
+        """
+        True if the service (index, or UNKNOWN_SERVICE for a trip without calendar) runs on the day.
+        Trips without calendar are considered as always running.
+        """
+        if service == UNKNOWN_SERVICE:
+            return True
+        offset = (self.parse_date(day) - self.start_date).days
+        if offset < 0 or offset >= self.day_count:
+            return False
+        return bool(self.bits[service * self.bytes_per_service + (offset >> 3)] >> (offset & 7) & 1)
+
+    def running_trips(self, trip_services, day):
+        """
+        Returns a bytearray with 1 for every trip (index) running on the day. Cached per day.
+        """
+        day = self.parse_date(day)
+        running_trips = self._running_trips.get(day)
+        if running_trips is None:
+            if len(self._running_trips) >= _RUNNING_TRIPS_CACHE_SIZE:
+                self._running_trips.clear()
+            running_services = bytearray(self.runs(service, day) for service in range(len(self.service_ids)))
+            running_trips = bytearray(
+                1 if service == UNKNOWN_SERVICE else running_services[service] for service in trip_services)
+            # Returned from the local variable: another request thread may clear the cache meanwhile
+            self._running_trips[day] = running_trips
+        return running_trips
+
+    def trip_services(self, trip_ids, trips):
+        """
+        Service index of every trip, from the {trip_id: {'service_id': ...}} trips of trips.txt.
+        """
+        return array('i', [
+            self.service_index.get(trips[trip_id]['service_id'], UNKNOWN_SERVICE) if trip_id in trips
+            else UNKNOWN_SERVICE
+            for trip_id in trip_ids
+        ])
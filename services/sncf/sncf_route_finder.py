@@ -1,33 +1,139 @@
+import os
 import csv
 import heapq
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import islice
 from tqdm import tqdm
-from collections import defaultdict
+from services.sncf.commune_coordinates import CommuneCoordinates, COMMUNE_COORDINATES_PATH
+from services.sncf.compiled_feed import InMemoryFeed
+from services.sncf.connection_scan import ConnectionScan
+from services.sncf.contraction_hierarchy import ContractionHierarchy
+from services.sncf.gtfs_compiler import GTFSCompiler
+from services.sncf.gtfs_time import parse_gtfs_time, format_gtfs_time, SECONDS_PER_DAY
+from services.sncf.route_graph import RouteGraph
+from services.sncf.route_search import RouteSearch, SearchResult, DIJKSTRA, CONTRACTION_HIERARCHY
+from services.sncf.service_calendar import ServiceCalendar
+from services.sncf.stop_name_index import StopNameIndex
+from services.sncf.stop_spatial_index import StopSpatialIndex
+from services.sncf.stop_table import StopTable
+from services.sncf.stop_times_table import StopTimesTable
+
+# Number of date-filtered graphs kept in memory
+DATED_GRAPH_CACHE_SIZE = 8
+# Route index of the trips missing from trips.txt (or whose route is missing from routes.txt)
+NO_ROUTE = -1
+CONTRACTION_HIERARCHY_PATH = 'assets/compiled/sncf_ch.bin'
+# Stations used for a town without a station of its name: the nearest ones, within this radius
+NEAREST_STATION_COUNT = 3
+NEAREST_STATION_RADIUS_KM = 15.0
 
 
 class SNCFRouteFinder:
-    def __init__(self):
-        self.stops = self.load_stops()
-        self.routes = self.load_routes()
-        self.stop_times = self.load_stop_times()
-        self.graph = self.build_graph_optimized()  # Utilisation de la nouvelle méthode
+    def __init__(self, data_dir='assets/data_sncf', compiled_path='assets/compiled/sncf_feed.bin', use_compiled=True,
+                 algorithm=DIJKSTRA, contraction_hierarchy_path=None,
+                 commune_coordinates_path=COMMUNE_COORDINATES_PATH):
+        """
+        Loads the SNCF feed. By default the stops and the graph come from the compiled feed (opened with mmap and
+        rebuilt only when the GTFS files change); use_compiled=False parses the GTFS files and builds the graph.
+        algorithm is the default search algorithm of the finder: "dijkstra", "astar", "csgraph" (SciPy) or "ch".
+        The "ch" algorithm needs contraction_hierarchy_path, where the contraction hierarchy of the graph is stored
+        (built on the first run, then again whenever the graph changes).
+        commune_coordinates_path is the local file of the commune coordinates (see CommuneCoordinates), used to
+        resolve a town without a station of its name to the nearest stations.
+        """
+        self.data_dir = data_dir
+        self.algorithm = algorithm
+        self.commune_coordinates_path = commune_coordinates_path
+        self._dated_graphs = {}
+        self._commune_coordinates = None
+        self._stop_spatial_index = None
+        compiler = GTFSCompiler(data_dir, compiled_path)
+        self.load_compiled(compiler.load() if use_compiled else InMemoryFeed(*compiler.build()))
+        self.stop_name_index = StopNameIndex(self.stops.names)
+        self.contraction_hierarchy = None
+        if contraction_hierarchy_path is not None:
+            self.contraction_hierarchy = ContractionHierarchy.load(contraction_hierarchy_path, self.graph)
+        self.route_search = RouteSearch(self.graph, self.contraction_hierarchy)
+
+    def load_compiled(self, feed):
+        self.feed_version = feed.metadata['feed_version']
+        stop_ids = feed.strings('stop_ids')
+        lats = feed.array('stop_lats')
+        lons = feed.array('stop_lons')
+        # Les arrêts et le graphe partagent la même table d'identifiants (indices des arrêts)
+        self.stops = StopTable(stop_ids, feed.strings('stop_names'), lats, lons)
+        self.routes = dict(zip(feed.strings('route_ids'), feed.strings('route_names')))
+        self.graph = RouteGraph(stop_ids, feed.array('graph_indptr'), feed.array('graph_indices'),
+                                feed.array('graph_weights'), lats, lons, feed.metadata['max_speed_kmh'],
+                                feed.array('graph_edge_trips'), self.stops.stop_index)
+        self.trip_ids = feed.strings('trip_ids')
+        self.trip_routes = feed.array('trip_routes')
+        self.trip_headsigns = feed.strings('trip_headsigns')
+        self.stop_stations = feed.array('stop_stations')
+        self.connection_scan = ConnectionScan(
+            feed.array('connection_departure_stops'), feed.array('connection_arrival_stops'),
+            feed.array('connection_departure_times'), feed.array('connection_arrival_times'),
+            feed.array('connection_trips'), self.stop_stations)
+        self.service_calendar = ServiceCalendar.from_feed(feed)
+        self.trip_services = feed.array('trip_services')
+        self._stop_times = StopTimesTable.from_feed(feed, self.trip_ids, stop_ids)
+
+    @property
+    def stop_times(self):
+        """
+        StopTimesTable of the feed, read in place from the compiled feed.
+        """
+        return self._stop_times
+
+    @property
+    def commune_coordinates(self):
+        """
+        CommuneCoordinates of the local commune file, read on first use.
+        """
+        if self._commune_coordinates is None:
+            self._commune_coordinates = CommuneCoordinates.load(self.commune_coordinates_path)
+        return self._commune_coordinates
+
+    @property
+    def stop_spatial_index(self):
+        """
+        StopSpatialIndex over the stations of the graph, built on first use.
+        """
+        if self._stop_spatial_index is None:
+            self._stop_spatial_index = StopSpatialIndex(self.graph.latitudes, self.graph.longitudes,
+                                                        self.stop_stations)
+        return self._stop_spatial_index
 
     @staticmethod
-    def load_stops():
-        stops = {}
-        file_path = 'assets/data_sncf/stops.txt'
+    def load_stops(data_dir='assets/data_sncf'):
+        """
+        Returns the stops of stops.txt as a StopTable (in file order).
+        """
+        stop_ids, names, latitudes, longitudes = [], [], array('d'), array('d')
+        file_path = os.path.join(data_dir, 'stops.txt')
         with open(file_path, mode='r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
             for row in tqdm(reader, desc="Loading stops", unit="stop"):
-                stops[row['stop_id']] = {
-                    'name': row['stop_name'],
-                    'lat': float(row['stop_lat']),
-                    'lon': float(row['stop_lon'])
-                }
-        return stops
+                stop_ids.append(row['stop_id'])
+                names.append(row['stop_name'])
+                latitudes.append(float(row['stop_lat']))
+                longitudes.append(float(row['stop_lon']))
+        return StopTable(stop_ids, names, latitudes, longitudes)
+
+    @staticmethod
+    def load_stop_parents(data_dir='assets/data_sncf'):
+        """
+        Returns the parent station (StopArea) of every stop that has one.
+        """
+        file_path = os.path.join(data_dir, 'stops.txt')
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            return {row['stop_id']: row['parent_station'] for row in csv.DictReader(file) if row.get('parent_station')}
 
     @staticmethod
-    def load_routes():
-        file_path = 'assets/data_sncf/routes.txt'
+    def load_routes(data_dir='assets/data_sncf'):
+        file_path = os.path.join(data_dir, 'routes.txt')
         routes = {}
         with open(file_path, mode='r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
@@ -36,36 +142,37 @@ class SNCFRouteFinder:
         return routes
 
     @staticmethod
-    def load_stop_times():
-        file_path = 'assets/data_sncf/stop_times.txt'
-        stop_times = defaultdict(list)  # Utilisation d'un defaultdict pour stocker par trip_id
+    def load_trips(data_dir='assets/data_sncf'):
+        file_path = os.path.join(data_dir, 'trips.txt')
+        trips = {}
         with open(file_path, mode='r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
-            for row in tqdm(reader, desc="Loading stop times", unit="stop time"):
-                stop_times[row['trip_id']].append({
-                    'trip_id': row['trip_id'],
-                    'stop_id': row['stop_id'],
-                    'arrival_time': row['arrival_time'],
-                    'departure_time': row['departure_time'],
-                    'stop_sequence': int(row['stop_sequence'])
-                })
-        return stop_times
-
-    def build_graph_optimized(self):
-        graph = defaultdict(list)
+            for row in tqdm(reader, desc="Loading trips", unit="trip"):
+                trips[row['trip_id']] = {
+                    'route_id': row['route_id'],
+                    'service_id': row['service_id'],
+                    'trip_headsign': row['trip_headsign']
+                }
+        return trips
 
-        for trip_id, stop_times in tqdm(self.stop_times.items(), desc="Building graph", unit="trip"):
-            # Trier par 'stop_sequence' pour que les arrêts soient dans l'ordre
-            stop_times = sorted(stop_times, key=lambda x: x['stop_sequence'])
+    @staticmethod
+    def load_stop_times(data_dir='assets/data_sncf', stop_ids=(), previous=None, workers=1):
+        return StopTimesTable.load(data_dir, stop_ids, previous, workers)
 
-            for i in range(len(stop_times) - 1):
-                current_stop = stop_times[i]
-                next_stop = stop_times[i + 1]
-                # Calcul du temps entre les arrêts actuels et suivants
-                time_diff = self.calculate_time_difference(current_stop, next_stop)
-                graph[current_stop['stop_id']].append((next_stop['stop_id'], time_diff))
+    def build_graph_optimized(self):
+        return self.build_graph(self.stops, self.stop_times)
 
-        return graph
+    @staticmethod
+    def build_graph(stops, stop_times, segments=None):
+        """
+        Builds the route graph from the trip segments of the StopTimesTable, weighted by the minutes between the
+        departure and the next arrival (like calculate_time_difference). Parallel segments are collapsed into the
+        fastest one, labelled with its trip.
+        """
+        from_stops, to_stops, departure_times, arrival_times, trips = segments or stop_times.segments()
+        latitudes, longitudes = stops.coordinates_of(stop_times.stop_ids)
+        return RouteGraph.from_segments(list(stop_times.stop_ids), latitudes, longitudes, from_stops, to_stops,
+                                        arrival_times // 60 - departure_times // 60, trips)
 
     @staticmethod
     def calculate_time_difference(stop_time, next_stop_time):
@@ -73,72 +180,362 @@ class SNCFRouteFinder:
         h2, m2, _ = map(int, next_stop_time['arrival_time'].split(':'))
         return (h2 - h1) * 60 + (m2 - m1)
 
-    def find_shortest_route(self, departure, destination):
-        departure_ids = self.get_stop_ids(departure)
-        destination_ids = self.get_stop_ids(destination)
+    def find_shortest_route(self, departure, destination, algorithm=None, date=None):
+        result = self.search_route(departure, destination, algorithm, date)
+        if not result or result.path is None:
+            return None
+        return [self.stops.stop_ids[stop] for stop in result.path]
+
+    def search_route(self, departure, destination, algorithm=None, date=None, direct_first=False):
+        """
+        Searches the best route between two cities with the chosen algorithm ("dijkstra", "astar", "csgraph" or "ch",
+        the finder default when None). With a date, only the trains running that day are used.
+        With direct_first, the fastest direct train between the two cities is returned when there is one (its id in
+        trip, no stop settled), and the graph is only searched for the journeys needing several trains.
+        Returns a SearchResult whose path holds stop indices (see stops), with the number of stops settled,
+        or None when one of the cities has no stop (other than the departure stops, see destination_stops).
+        """
+        departure_stops = self.get_stops(departure)
+        destination_stops = self.destination_stops(destination, departure_stops)
+
+        if not departure_stops or not destination_stops:
+            return None
+
+        # The duration of a direct train counts its stops along the way, a graph cost only the running times of
+        # the segments (neither the stops nor the waits between trains): the two are not compared, a direct train
+        # is returned whenever there is one, with its actual duration
+        if direct_first:
+            direct = self.direct_trip(departure_stops, destination_stops, date)
+            if direct is not None:
+                return direct
+
+        # Une seule recherche depuis toutes les gares de départ vers la première gare d'arrivée atteinte
+        algorithm = algorithm or self.algorithm
+        route_search = self.route_search
+        if date is not None:
+            route_search = RouteSearch(self.graph_for_day(date))
+            # La hiérarchie de contraction ne couvre que le graphe statique
+            if algorithm == CONTRACTION_HIERARCHY:
+                algorithm = DIJKSTRA
+        return route_search.shortest_path(departure_stops, destination_stops, algorithm)
+
+    def direct_trip(self, departure_stops, destination_stops, date=None):
+        """
+        Fastest single train from one of the departure stops to one of the destination stops (indices), found from
+        the per-stop index of the stop times: the trips serving both, in this order, are matched by trip index.
+        With a date, only the trains running that day are considered.
+        Returns a SearchResult (duration in minutes from the departure to the arrival, stops along the way
+        included, stops of the trip from boarding to alighting, trip index), or None when no train serves both.
+        """
+        stop_times = self.stop_times
+        trips, stop_sequences = stop_times.trips, stop_times.stop_sequences
+        running_trips = None if date is None else self.running_trips(date)
 
-        if not departure_ids or not destination_ids:
+        boardings = {}
+        for stop in departure_stops:
+            for row in stop_times.rows_at_stop(stop):
+                if running_trips is None or running_trips[trips[row]]:
+                    boardings.setdefault(trips[row], []).append(row)
+        best = None
+        for stop in destination_stops:
+            for alighting in stop_times.rows_at_stop(stop):
+                for boarding in boardings.get(trips[alighting], ()):
+                    if stop_sequences[boarding] < stop_sequences[alighting]:
+                        # Minutes rounded like the graph edge weights, stops along the way included
+                        duration = (stop_times.arrival_times[alighting] // 60
+                                    - stop_times.departure_times[boarding] // 60)
+                        candidate = (duration, trips[alighting], boarding, alighting)
+                        if best is None or candidate < best:
+                            best = candidate
+        if best is None:
             return None
 
-        # Trouver le meilleur itinéraire entre toutes les combinaisons de gares de départ et d'arrivée
-        best_route = None
-        shortest_time = float('inf')
-
-        for dep_id in departure_ids:
-            for dest_id in destination_ids:
-                route = self.dijkstra(dep_id, dest_id)
-                if route:
-                    # Récupérer les informations d'arrêt complètes pour calculer le temps total
-                    route_time = sum(
-                        self.calculate_time_difference(self.get_stop_time(route[i]), self.get_stop_time(route[i + 1]))
-                        for i in range(len(route) - 1)
-                    )
-                    if route_time < shortest_time:
-                        best_route = route
-                        shortest_time = route_time
-
-        return best_route
+        duration, trip, boarding, alighting = best
+        rows = stop_times.rows_of_trip(trip)
+        path = []
+        for row in rows:
+            if stop_sequences[boarding] <= stop_sequences[row] <= stop_sequences[alighting]:
+                path.append(stop_times.stops[row])
+        return SearchResult(duration, path, 0, trip)
+
+    def find_shortest_routes(self, departure, destinations, date=None):
+        """
+        Routes from one city to many, as {destination: path of stop ids or None}. See search_routes.
+        """
+        return {destination: [self.stops.stop_ids[stop] for stop in result.path] if result and result.path else None
+                for destination, result in self.search_routes(departure, destinations, date).items()}
+
+    def search_routes(self, departure, destinations, date=None):
+        """
+        Searches the best routes from one city to many with a single shortest path tree, grown from the stops of
+        the departure city until every destination city is reached. The results are the same as one Dijkstra
+        search_route per destination, for roughly the cost of the farthest one.
+        Returns {destination: SearchResult whose path holds stop indices, or None when the city has no stop
+        other than the departure stops}.
+        """
+        departure_stops = self.get_stops(departure)
+        destination_stops = {destination: self.destination_stops(destination, departure_stops)
+                             for destination in destinations}
+        if not departure_stops:
+            return {destination: None for destination in destinations}
+
+        route_search = self.route_search if date is None else RouteSearch(self.graph_for_day(date))
+        searched = [destination for destination, stops in destination_stops.items() if stops]
+        results = route_search.shortest_path_tree(departure_stops,
+                                                  [destination_stops[destination] for destination in searched])
+
+        routes = {destination: None for destination in destinations}
+        routes.update(zip(searched, results))
+        return routes
+
+    def isochrone(self, departure, max_minutes, date=None):
+        """
+        Every stop reachable from a city within max_minutes (route graph travel times, without waiting times).
+        With a date, only the trains running that day are used.
+        Returns compact arrays, sorted by travel time: {'stops' (indices), 'latitudes', 'longitudes', 'minutes'}
+        (NaN coordinates for the stops missing from stops.txt), or None when the city has no stop.
+        """
+        departure_stops = self.get_stops(departure)
+        if not departure_stops:
+            return None
+
+        graph = self.graph if date is None else self.graph_for_day(date)
+        route_search = self.route_search if date is None else RouteSearch(graph)
+        reached = route_search.reachable(departure_stops, max_minutes)
+        return {
+            'stops': reached.stops,
+            'latitudes': array('d', [graph.latitudes[stop] for stop in reached.stops]),
+            'longitudes': array('d', [graph.longitudes[stop] for stop in reached.stops]),
+            'minutes': reached.costs,
+        }
+
+    def travel_time_matrix(self, origins, destinations=None, date=None):
+        """
+        Many-to-many travel times in minutes between stops (ids), computed by SciPy in a single csgraph call.
+        Returns (times, predecessors): times[i, j] goes from origins[i] to destinations[j] (every stop of the graph,
+        in graph order, when destinations is None) and is inf when unreachable; predecessors[i] is the predecessor
+        row of origins[i], see CSGraphBackend.rebuild_path. With a date, only the trains running that day are used.
+        Raises KeyError for a stop missing from the graph, rows and columns being aligned on the given stops.
+        """
+        route_search = self.route_search if date is None else RouteSearch(self.graph_for_day(date))
+        stop_index = self.graph.stop_index
+        targets = None if destinations is None else [stop_index[stop_id] for stop_id in destinations]
+        return route_search.csgraph_backend.distance_matrix([stop_index[stop_id] for stop_id in origins], targets)
+
+    def graph_for_day(self, day):
+        """
+        Route graph restricted to the trips running on the day, built from the timetable connections and the
+        service calendar bitsets. Cached per day.
+        """
+        day = ServiceCalendar.parse_date(day)
+        graph = self._dated_graphs.get(day)
+        if graph is None:
+            if len(self._dated_graphs) >= DATED_GRAPH_CACHE_SIZE:
+                self._dated_graphs.clear()
+            graph = RouteGraph.from_connections(self.graph, self.connection_scan, self.running_trips(day))
+            # Returned from the local variable: another request thread may clear the cache meanwhile
+            self._dated_graphs[day] = graph
+        return graph
+
+    def running_trips(self, day):
+        return self.service_calendar.running_trips(self.trip_services, day)
+
+    def find_earliest_arrival(self, departure, destination, departure_time, date=None):
+        """
+        Timetable-aware journey between two cities, leaving at or after departure_time ("HH:MM", "HH:MM:SS" or
+        seconds since the start of the service day), that arrives as early as possible.
+        With a date, only the trains running that day can be taken.
+        Returns the list of legs (one per train taken, with real departure and arrival times), or None.
+        """
+        departure_stops = self.get_stops(departure)
+        destination_stops = self.destination_stops(destination, departure_stops)
+
+        if not departure_stops or not destination_stops:
+            return None
+
+        legs = self.connection_scan.earliest_arrival(departure_stops, destination_stops,
+                                                     self.parse_time(departure_time),
+                                                     None if date is None else self.running_trips(date))
+        if legs is None:
+            return None
+        return [
+            {
+                'trip_id': self.trip_ids[leg.trip],
+                'departure_stop_id': self.graph.stop_ids[leg.departure_stop],
+                'departure_time': format_gtfs_time(leg.departure_time),
+                'arrival_stop_id': self.graph.stop_ids[leg.arrival_stop],
+                'arrival_time': format_gtfs_time(leg.arrival_time),
+            }
+            for leg in legs
+        ]
+
+    @staticmethod
+    def parse_time(value):
+        """
+        Seconds since the start of the service day, from "HH:MM", "HH:MM:SS" or seconds.
+        """
+        if isinstance(value, str):
+            return parse_gtfs_time(value if value.count(':') == 2 else f"{value}:00")
+        return value
+
+    def departures(self, station, after, date=None, count=10):
+        """
+        Departure board: the next count departures from the stops of a station (or city), at or after `after`
+        ("HH:MM", "HH:MM:SS" or seconds since midnight), sorted by departure time.
+        With a date, only the trains running that day are listed, including the trains of the previous service
+        day still running after midnight. Returns a list of departures (trip, stop, time, line and headsign),
+        or None when no stop matches the station.
+        """
+        stops = self.get_stops(station)
+        if not stops:
+            return None
+
+        after = self.parse_time(after)
+        if date is None:
+            service_days = [(None, 0)]
+        else:
+            date = ServiceCalendar.parse_date(date)
+            service_days = [(self.running_trips(date), 0),
+                            (self.running_trips(date - timedelta(days=1)), SECONDS_PER_DAY)]
+        # One stream of departures, sorted by time, per stop and service day
+        streams = [self._departures_from(stop, after, running_trips, offset)
+                   for stop in stops for running_trips, offset in service_days]
+
+        stop_times = self.stop_times
+        route_ids = list(self.routes)
+        departures = []
+        for departure_time, row in islice(heapq.merge(*streams), count):
+            trip, stop = stop_times.trips[row], stop_times.stops[row]
+            route = self.trip_routes[trip]
+            departures.append({
+                'trip_id': self.trip_ids[trip],
+                'stop_id': self.stops.stop_ids[stop],
+                'stop_name': self.stops.name(stop),
+                'departure_time': format_gtfs_time(departure_time),
+                'route_name': None if route == NO_ROUTE else self.routes[route_ids[route]],
+                'headsign': self.trip_headsigns[trip] or None,
+            })
+        return departures
+
+    def _departures_from(self, stop, after, running_trips, offset):
+        """
+        Yields the (departure time, row) of the departures from a stop (index) at or after `after`, the trips of
+        the service day starting offset seconds earlier (times are given relative to the requested day).
+        """
+        stop_times = self.stop_times
+        rows = stop_times.departures_at_stop(stop)
+        departure_times, trips = stop_times.departure_times, stop_times.trips
+        start = bisect_left(rows, after + offset, key=lambda row: departure_times[row])
+        for row in rows[start:]:
+            if running_trips is None or running_trips[trips[row]]:
+                yield departure_times[row] - offset, row
+
+    def route_names(self, path, date=None, trip=None):
+        """
+        For every hop of a path (stop indices), the name of the line (routes.txt route_long_name) of the trip that
+        achieves the edge weight, or None when unknown. With trip (the index of a direct train), the line of that
+        trip.
+        """
+        route_ids = list(self.routes)
+        if trip is not None:
+            route = self.trip_routes[trip]
+            return [None if route == NO_ROUTE else self.routes[route_ids[route]]] * (len(path) - 1)
+        graph = self.graph if date is None else self.graph_for_day(date)
+        names = []
+        for stop, next_stop in zip(path, path[1:]):
+            position = graph.edge_position(stop, next_stop)
+            route = NO_ROUTE if position is None else self.trip_routes[graph.edge_trips[position]]
+            names.append(None if route == NO_ROUTE else self.routes[route_ids[route]])
+        return names
 
     def get_stop_time(self, stop_id):
         """Récupère l'arrêt complet (avec heures d'arrivée et de départ) basé sur le stop_id"""
-        for trip in self.stop_times.values():
-            for stop in trip:
-                if stop['stop_id'] == stop_id:
-                    return stop
-        return None
+        stop = self.graph.stop_index.get(stop_id)
+        if stop is None:
+            return None
+        rows = self.stop_times.rows_at_stop(stop)
+        # Premier passage du premier trajet (dans l'ordre du fichier) desservant l'arrêt
+        return self.stop_time_record(rows[0]) if len(rows) else None
 
-    def get_stop_ids(self, city_name):
+    def get_stop_times(self, stop_id):
         """
-        Retrieves the IDs of the stops associated with a city (several stations possible).
+        All the stop times of a stop, ordered by trip, from the per-stop index.
         """
-        stop_ids = []
-        for stop_id, stop_data in self.stops.items():
-            stop_name = stop_data['name']  # Récupère le nom de l'arrêt
-            if city_name.lower() in stop_name.lower():
-                stop_ids.append(stop_id)
-        return stop_ids
+        stop = self.graph.stop_index.get(stop_id)
+        if stop is None:
+            return []
+        return [self.stop_time_record(row) for row in self.stop_times.rows_at_stop(stop)]
 
-    def dijkstra(self, start, goal):
-        queue = [(0, start, [])]
-        visited = set()
-        total_stops = len(self.graph)  # Number of stops to give tqdm an idea of total progress
+    def stop_time_record(self, row):
+        """
+        Returns a row of the StopTimesTable as a stop_times.txt record.
+        """
+        stop_times = self.stop_times
+        return {
+            'trip_id': stop_times.trip_ids[stop_times.trips[row]],
+            'stop_id': stop_times.stop_ids[stop_times.stops[row]],
+            'arrival_time': format_gtfs_time(stop_times.arrival_times[row]),
+            'departure_time': format_gtfs_time(stop_times.departure_times[row]),
+            'stop_sequence': stop_times.stop_sequences[row]
+        }
 
-        with tqdm(total=total_stops, desc="Finding shortest route", unit="stop") as progress_bar:
-            while queue:
-                (cost, node, path) = heapq.heappop(queue)
-                if node in visited:
-                    continue
+    def get_stop_ids(self, city_name):
+        """
+        Retrieves the IDs of the stops associated with a city (several stations possible). See get_stops.
+        """
+        return [self.stops.stop_ids[stop] for stop in self.get_stops(city_name)]
 
-                visited.add(node)
-                path = path + [node]
+    def get_stops(self, city_name):
+        """
+        Retrieves the indices of the stops associated with a city (several stations possible).
+        The name is matched accent, case, hyphen and "St"/"Saint" insensitively. When no stop matches, the city
+        is located with the commune coordinates and the stops of the nearest stations are returned; failing that,
+        the name is taken as misspelled and matched to the closest stop names ("Montpelier" -> "Montpellier").
+        """
+        stops = self.stop_name_index.lookup(city_name)
+        if not stops:
+            stops = self.nearest_stops(city_name)
+        if not stops:
+            stops = self.stop_name_index.lookup_fuzzy(city_name)
+        return stops
 
-                if node == goal:
-                    return path
+    def destination_stops(self, city_name, departure_stops):
+        """
+        Stops of the destination city (see get_stops), without the departure stops: a stop named after both cities
+        ("Gare de Paris-Gare-de-Lyon" for Paris and Lyon) would otherwise be a route of 0 minutes.
+        """
+        departure_stops = set(departure_stops)
+        return [stop for stop in self.get_stops(city_name) if stop not in departure_stops]
 
-                for neighbor, weight in self.graph.get(node, []):
-                    if neighbor not in visited:
-                        heapq.heappush(queue, (cost + weight, neighbor, path))
+    def snap_city_name(self, city_name, city_name_index):
+        """
+        Spelling of a city name to search: the name itself when a stop name matches it (see StopNameIndex.lookup),
+        otherwise its closest city name in city_name_index (a FuzzyNameIndex), for a misspelled city
+        ("Montpelier" -> "Montpellier"). A station name close to another city ("Auneau" / "Duneau") is kept.
+        """
+        if self.stop_name_index.lookup(city_name):
+            return city_name
+        return city_name_index.snap(city_name)
 
-                progress_bar.update(1)
+    def nearest_stops(self, city_name, count=NEAREST_STATION_COUNT, radius_km=NEAREST_STATION_RADIUS_KM):
+        """
+        Indices of the stops of the (up to) count stations nearest to the commune, within radius_km, nearest first.
+        Empty when the commune is unknown or has no station around.
+        """
+        coordinates = self.commune_coordinates.lookup(city_name)
+        if coordinates is None:
+            return []
+        return self.stop_spatial_index.nearest_stops(*coordinates, count, radius_km)
+
+    def dijkstra(self, start, goal):
+        return self.multi_source_dijkstra([start], [goal])
 
-        return None
\ No newline at end of file
+    def multi_source_dijkstra(self, starts, goals):
+        """
+        Shortest path from any of the start stops to any of the goal stops. Every start stop is seeded at cost 0 and
+        the search stops at the first goal stop settled, which is the best route among all the (start, goal) pairs.
+        """
+        result = self.route_search.shortest_path(self.graph.indices_of(starts), self.graph.indices_of(goals))
+        if result.path is None:
+            return None
+        return [self.graph.stop_ids[index] for index in result.path]
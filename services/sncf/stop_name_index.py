@@ -0,0 +1,137 @@
+import re
+import unicodedata
+
+"""
+Inverted index over the normalized stop names, used to resolve a city name to its stops (indices).
+
+Names and queries are normalized the same way (lowercase, accents folded, "St"/"Ste" written "saint"/"sainte",
+hyphens and punctuation turned into spaces), then a query matches every stop whose normalized name contains it,
+like the former case-insensitive substring test but without scanning every stop on each lookup. A first or last
+query word "St"/"Ste" may also be a piece of a word ("Gare de St" in "Gare de Strasbourg"), so it is searched both
+ways: every stop found by the former substring test is still returned, except for a query without any letter or
+digit (e.g. "(" or "."), which matches no stop.
+"""
+
+_SEPARATORS = re.compile(r"[^0-9a-z]+")
+_LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss'})
+_ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte'}
+# Queries come from user input: the memoized results are dropped once this many distinct queries were seen
+_CACHE_SIZE = 4096
+
+
+class StopNameIndex:
+    def __init__(self, names):
+        """
+        names holds the name of every stop, by stop index (StopTable.names); results are stop indices, in order.
+        """
+        self._names = []
+        self._stops_by_name = []
+        self._tokens = {}
+        self._containing = {}
+        self._cache = {}
+        self._word_index = None
+
+        name_ids = {}
+        normalized_names = {}
+        for stop, name in enumerate(names):
+            # The StopArea and its StopPoints share the same name
+            if name not in normalized_names:
+                normalized_names[name] = self.normalize(name)
+            normalized = normalized_names[name]
+            if normalized not in name_ids:
+                name_ids[normalized] = len(self._names)
+                # Padded with spaces so that a full query word can be searched as " word "
+                self._names.append(f" {normalized} ")
+                self._stops_by_name.append([])
+                for token in set(normalized.split()):
+                    self._tokens.setdefault(token, set()).add(name_ids[normalized])
+            self._stops_by_name[name_ids[normalized]].append(stop)
+
+    @staticmethod
+    def normalize(text):
+        """
+        "Gare de Bordeaux-St-Jean" -> "gare de bordeaux saint jean"
+        """
+        return ' '.join(_ABBREVIATIONS.get(token, token) for token in StopNameIndex.words(text))
+
+    @staticmethod
+    def words(text):
+        """
+        Words of the text, normalized like normalize but without writing out the abbreviations.
+        """
+        text = unicodedata.normalize('NFKD', text.lower().translate(_LIGATURES))
+        text = text.encode('ascii', 'ignore').decode('ascii')
+        return [token for token in _SEPARATORS.split(text) if token]
+
+    def lookup(self, city_name):
+        """
+        Returns the indices of the stops whose normalized name contains the normalized city name (none for a name
+        without any letter or digit).
+        """
+        words = self.words(city_name)
+        key = ' '.join(words)
+        stops = self._cache.get(key)
+        if stops is None:
+            if len(self._cache) >= _CACHE_SIZE:
+                self._cache.clear()
+                self._containing.clear()
+            queries = self._queries(words)
+            stops = sorted(set().union(*map(self._search, queries))) if len(queries) > 1 else self._search(*queries)
+            self._cache[key] = stops
+        return list(stops)
+
+    def lookup_fuzzy(self, city_name):
+        """
+        Like lookup, for a misspelled name: every word of the name that is not a word of a stop name is replaced by
+        the closest one (see FuzzyNameIndex), then the corrected name is looked up.
+        Returns an empty list when a word has no close enough word, or when the name has nothing to correct.
+        """
+        if self._word_index is None:
+            # Imported here, the fuzzy index itself normalizes the names with this class
+            from services.sncf.fuzzy_name_index import FuzzyNameIndex
+            self._word_index = FuzzyNameIndex(self._tokens)
+        tokens = self.normalize(city_name).split()
+        corrected = [token if token in self._tokens else self._word_index.best(token) for token in tokens]
+        if None in corrected or corrected == tokens:
+            return []
+        return self.lookup(' '.join(corrected))
+
+    @staticmethod
+    def _queries(words):
+        """
+        Normalized queries of the words: the first and the last words can be cut, so an abbreviation there is
+        searched both written out and as typed.
+        """
+        expanded = [_ABBREVIATIONS.get(word, word) for word in words]
+        if len(words) < 2:
+            return {' '.join(expanded), ' '.join(words)}
+        return {' '.join([first, *expanded[1:-1], last])
+                for first in (expanded[0], words[0]) for last in (expanded[-1], words[-1])}
+
+    def _search(self, query):
+        tokens = query.split()
+        if not tokens:
+            return []
+
+        # Words in the middle of the query are full words of the name: exact postings.
+        # The first and the last words can be cut (suffix / prefix of a word): postings of the words containing them.
+        candidates = None
+        for position, token in enumerate(tokens):
+            is_inner = 0 < position < len(tokens) - 1
+            postings = self._tokens.get(token, set()) if is_inner else self._names_containing(token)
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                return []
+
+        return sorted(stop
+                      for name_id in candidates if query in self._names[name_id]
+                      for stop in self._stops_by_name[name_id])
+
+    def _names_containing(self, token):
+        name_ids = self._containing.get(token)
+        if name_ids is None:
+            # Returned from the local variable: another thread may clear the memo meanwhile
+            name_ids = set().union(*(word_name_ids for word, word_name_ids in self._tokens.items()
+                                     if token in word))
+            self._containing[token] = name_ids
+        return name_ids
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from services.sncf.geo import EARTH_RADIUS_KM
+
+"""
+Spatial index over the stations of the route graph, to resolve a place (e.g. a small town without a station of its
+name) to the nearest stations.
+
+Stations are the StopAreas of stops.txt (the stop_stations section of the compiled feed): every stop of the graph
+belongs to its station, so a station found near a place resolves to all of its stops. The stations are placed on
+the unit sphere and stored in a KD-tree, where the straight (chord) distance between two points grows with their
+great-circle distance: a K nearest neighbours query within a radius costs a few microseconds.
+"""
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    (n, 3) cartesian coordinates on the unit sphere of WGS84 degrees.
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes),
+                            np.sin(latitudes)))
+
+
+class StopSpatialIndex:
+    def __init__(self, latitudes, longitudes, stop_stations):
+        """
+        latitudes / longitudes of every stop of the graph (NaN when unknown) and stop_stations, the station (stop
+        index) of every stop. Stations without coordinates are left out.
+        """
+        stop_stations = np.asarray(stop_stations, dtype=np.int32)
+        # Stops grouped by station: the stops of stations[i] are members[member_indptr[i]:member_indptr[i + 1]]
+        self.stations, member_counts = np.unique(stop_stations, return_counts=True)
+        self.members = np.argsort(stop_stations, kind='stable').astype(np.int32)
+        self.member_indptr = np.concatenate(([0], np.cumsum(member_counts))).astype(np.int32)
+
+        points = to_unit_vectors(np.asarray(latitudes)[self.stations], np.asarray(longitudes)[self.stations])
+        self._located = np.flatnonzero(np.isfinite(points).all(axis=1))
+        self._tree = cKDTree(points[self._located])
+
+    def __len__(self):
+        return len(self._located)
+
+    def nearest_stations(self, latitude, longitude, k=3, radius_km=15.0):
+        """
+        The (up to) k stations closest to the point within radius_km (great-circle distance), nearest first.
+        Returns a list of (station stop index, distance in km).
+        """
+        if not len(self._located):
+            return []
+        # Chord length of the radius on the unit sphere
+        max_chord = 2 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        point = (math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude),
+                 math.sin(latitude))
+        chords, positions = self._tree.query(point, k=list(range(1, k + 1)),
+                                             distance_upper_bound=max_chord)
+        return [(int(self.stations[self._located[position]]),
+                 float(2 * EARTH_RADIUS_KM * np.arcsin(min(1.0, chord / 2))))
+                for chord, position in zip(chords, positions) if position < len(self._located)]
+
+    def nearest_stops(self, latitude, longitude, k=3, radius_km=15.0):
+        """
+        Stop indices of the k nearest stations within radius_km (see nearest_stations) and of all their stops,
+        station by station, nearest first.
+        """
+        stops = []
+        for station, _ in self.nearest_stations(latitude, longitude, k, radius_km):
+            position = np.searchsorted(self.stations, station)
+            stops.extend(self.members[self.member_indptr[position]:self.member_indptr[position + 1]].tolist())
+        return stops
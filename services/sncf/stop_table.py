@@ -0,0 +1,64 @@
+import math
+from array import array
+from typing import NamedTuple
+
+"""
+Column store of the stops, with the interning table of their GTFS ids.
+
+Every stop id (e.g. "StopArea:OCE87381509") is mapped once, at load time, to a dense integer index, the same index
+as in the route graph and the stop times; the finder then only handles these integers, and the strings are looked
+up again when a response is built. Names and coordinates are kept in columns (a list and two typed arrays, read in
+place from the compiled feed) instead of one dict per stop.
+The stops of stops.txt come first; the ids can go on with the stops only referenced by stop_times.txt, which have
+no name and NaN coordinates.
+"""
+
+
+class Stop(NamedTuple):
+    stop_id: str
+    name: str
+    lat: float
+    lon: float
+
+
+class StopTable:
+    def __init__(self, stop_ids, names, latitudes, longitudes, stop_index=None):
+        self.stop_ids = stop_ids
+        self.names = names
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.stop_index = stop_index if stop_index is not None else {
+            stop_id: index for index, stop_id in enumerate(stop_ids)}
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __iter__(self):
+        return iter(self.stop_ids)
+
+    @property
+    def stop_count(self):
+        """
+        Number of stops of stops.txt.
+        """
+        return len(self.names)
+
+    def name(self, stop):
+        """
+        Name of the stop (index), None for a stop missing from stops.txt.
+        """
+        return self.names[stop] if stop < len(self.names) else None
+
+    def record(self, stop):
+        """
+        The stop (index) as a Stop record, with its id and name as strings.
+        """
+        return Stop(self.stop_ids[stop], self.name(stop), self.latitudes[stop], self.longitudes[stop])
+
+    def coordinates_of(self, stop_ids):
+        """
+        (latitudes, longitudes) arrays of the stops (ids), NaN for the unknown ones.
+        """
+        positions = [self.stop_index.get(stop_id) for stop_id in stop_ids]
+        return (array('d', [math.nan if position is None else self.latitudes[position] for position in positions]),
+                array('d', [math.nan if position is None else self.longitudes[position] for position in positions]))
@@ -0,0 +1,487 @@
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+from services.sncf.compiled_feed import to_array
+from services.sncf.gtfs_time import parse_gtfs_time
+
+"""
+Columnar stop_times.txt: one typed array per column instead of one dict per stop time.
+
+Trip and stop ids are interned into dense int32 indices (trip_ids / stop_ids hold the strings), times are int32
+seconds since the start of the service day (GTFS times after 24:00:00 included) and stop sequences are uint16.
+The file is streamed row by row into the arrays, then the trip segments used by the graph and the Connection
+Scan are computed in one vectorized pass. A per-stop index (CSR over the rows, sorted by stop then trip) gives the
+stop times of a stop without scanning the table, and a second one keeps the departures of every stop (its stop
+times except the last stop of each trip) sorted by departure time, for departure boards. A per-trip index gives
+the stop times of a trip in stop sequence order.
+
+Every trip also gets a content hash (CRC-32 of its rows in file order). When the feed is refreshed, the trips
+whose hash did not change are copied from the previous table instead of being parsed again.
+
+A large file can be parsed by several processes: it is cut into byte ranges ending where a trip ends, every
+process parses its range with its own numbering of the trips and stops, and the shards are merged in file order
+by renumbering them, which gives the same table as a single process.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Smallest byte range parsed by a process: below it, starting the processes costs more than it saves
+MIN_SHARD_BYTES = 1 << 20
+
+
+class StopTimesTable:
+    def __init__(self, trip_ids, stop_ids, trips, stops, arrival_times, departure_times, stop_sequences,
+                 stop_row_indptr=None, stop_rows=None, trip_hashes=None, departure_indptr=None,
+                 departure_rows=None, trip_row_indptr=None, trip_rows=None):
+        self.trip_ids = trip_ids
+        self.trip_hashes = trip_hashes
+        self.stop_ids = stop_ids
+        self.trips = trips
+        self.stops = stops
+        self.arrival_times = arrival_times
+        self.departure_times = departure_times
+        self.stop_sequences = stop_sequences
+        self._stop_row_indptr = stop_row_indptr
+        self._stop_rows = stop_rows
+        self._departure_indptr = departure_indptr
+        self._departure_rows = departure_rows
+        self._trip_row_indptr = trip_row_indptr
+        self._trip_rows = trip_rows
+
+    @classmethod
+    def from_feed(cls, feed, trip_ids=None, stop_ids=None):
+        """
+        Table read in place from the stop_time_* sections of a compiled feed.
+        """
+        return cls(
+            feed.strings('trip_ids') if trip_ids is None else trip_ids,
+            feed.strings('stop_ids') if stop_ids is None else stop_ids,
+            feed.array('stop_time_trips'), feed.array('stop_time_stops'), feed.array('stop_time_arrival_times'),
+            feed.array('stop_time_departure_times'), feed.array('stop_time_stop_sequences'),
+            feed.array('stop_time_stop_row_indptr'), feed.array('stop_time_stop_rows'),
+            feed.array('stop_time_trip_hashes'), feed.array('stop_time_departure_indptr'),
+            feed.array('stop_time_departure_rows'), feed.array('stop_time_trip_row_indptr'),
+            feed.array('stop_time_trip_rows'))
+
+    @classmethod
+    def load(cls, data_dir='assets/data_sncf', stop_ids=(), previous=None, workers=1):
+        """
+        Streams stop_times.txt into the columns. stop_ids seeds the stop numbering (the stops of stops.txt, so
+        that stop indices match the graph); stops only found in stop_times.txt are numbered after them.
+        Trips are numbered in order of first appearance.
+        With previous (the table of the last compiled feed), the unchanged trips are copied from it, see
+        load_incremental. Otherwise, with workers > 1, a large file is parsed by several processes, see
+        load_parallel.
+        """
+        if previous is not None and previous.trip_hashes is not None:
+            table = cls.load_incremental(data_dir, stop_ids, previous)
+            if table is not None:
+                return table
+        if workers > 1:
+            table = cls.load_parallel(data_dir, stop_ids, workers)
+            if table is not None:
+                return table
+
+        file_path = os.path.join(data_dir, 'stop_times.txt')
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            columns = cls.columns_of(next(reader))
+            parsed = parse_rows(tqdm(reader, desc="Loading stop times", unit="stop time"), columns, stop_ids)
+        trip_ids, stop_ids, trip_hashes, trips, stops, arrival_times, departure_times, stop_sequences = parsed
+        return cls(trip_ids, stop_ids, trips, stops, arrival_times, departure_times, stop_sequences,
+                   trip_hashes=trip_hashes)
+
+    @staticmethod
+    def columns_of(header):
+        """
+        Positions of the trip_id, stop_id, arrival_time, departure_time and stop_sequence columns in the header.
+        """
+        return tuple(header.index(name) for name in
+                     ('trip_id', 'stop_id', 'arrival_time', 'departure_time', 'stop_sequence'))
+
+    @classmethod
+    def load_parallel(cls, data_dir, stop_ids, workers):
+        """
+        Loads stop_times.txt like load, with up to workers processes each parsing a range of the file (at least
+        MIN_SHARD_BYTES, ranges end between two trips). The result is identical to a single process load.
+        Returns None when the file is too small to be split, or when the rows of a trip are not contiguous
+        (a trip would then be split between two ranges, and its content hash could not be computed).
+        """
+        file_path = os.path.join(data_dir, 'stop_times.txt')
+        with open(file_path, mode='rb') as file:
+            header = file.readline()
+            columns = cls.columns_of(next(csv.reader([header.decode('utf-8')])))
+            data_start, file_size = file.tell(), os.fstat(file.fileno()).st_size
+            shard_count = min(workers, (file_size - data_start) // MIN_SHARD_BYTES)
+            if shard_count < 2:
+                return None
+            bounds = [data_start]
+            for shard in range(1, shard_count):
+                bound = cls.trip_boundary(file, data_start + (file_size - data_start) * shard // shard_count,
+                                          columns[0])
+                if bound > bounds[-1]:
+                    bounds.append(bound)
+            bounds.append(file_size)
+
+        logger.info(f"Loading the stop times with {len(bounds) - 1} processes")
+        # Spawned (not forked) workers: the feed is also compiled inside the API, whose threads (model loading,
+        # torch) could hold a lock at fork time and deadlock the child
+        with ProcessPoolExecutor(max_workers=len(bounds) - 1,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            shards = list(executor.map(parse_shard, [file_path] * (len(bounds) - 1), bounds[:-1], bounds[1:],
+                                       [columns] * (len(bounds) - 1)))
+
+        # Trips and stops renumbered in file order: shard by shard, in order of first appearance in each shard
+        stop_ids = list(stop_ids)
+        stop_index = {stop_id: index for index, stop_id in enumerate(stop_ids)}
+        trip_ids = []
+        trip_index = {}
+        trip_hashes = array('I')
+        parts = {name: [] for name in ('trips', 'stops', 'arrival_times', 'departure_times', 'stop_sequences')}
+        for shard_trip_ids, shard_stop_ids, shard_trip_hashes, trips, stops, *times in shards:
+            trip_remap = np.empty(len(shard_trip_ids), dtype=np.int32)
+            for trip, trip_id in enumerate(shard_trip_ids):
+                if trip_id in trip_index:
+                    logger.info("The stop times of the trips are not contiguous, loading them in a single process.")
+                    return None
+                trip_remap[trip] = trip_index[trip_id] = len(trip_ids)
+                trip_ids.append(trip_id)
+            stop_remap = np.empty(len(shard_stop_ids), dtype=np.int32)
+            for stop, stop_id in enumerate(shard_stop_ids):
+                if stop_id not in stop_index:
+                    stop_index[stop_id] = len(stop_ids)
+                    stop_ids.append(stop_id)
+                stop_remap[stop] = stop_index[stop_id]
+            trip_hashes.extend(shard_trip_hashes)
+            parts['trips'].append(trip_remap[np.frombuffer(trips, dtype=np.int32)])
+            parts['stops'].append(stop_remap[np.frombuffer(stops, dtype=np.int32)])
+            for name, values in zip(('arrival_times', 'departure_times', 'stop_sequences'), times):
+                parts[name].append(np.frombuffer(values, dtype=np.dtype(values.typecode)))
+
+        def merge(name, typecode):
+            return to_array(typecode, np.concatenate(parts[name]))
+
+        return cls(trip_ids, stop_ids, merge('trips', 'i'), merge('stops', 'i'), merge('arrival_times', 'i'),
+                   merge('departure_times', 'i'), merge('stop_sequences', 'H'), trip_hashes=trip_hashes)
+
+    @staticmethod
+    def trip_boundary(file, offset, trip_column):
+        """
+        Offset of the first line, from the line following offset, whose trip differs from the one of the line
+        before it (the end of the file when there is none).
+        """
+        file.seek(offset)
+        file.readline()
+        previous_trip_id = None
+        while True:
+            position = file.tell()
+            line = file.readline()
+            if not line:
+                return position
+            trip_id = next(csv.reader([line.decode('utf-8')]))[trip_column]
+            if previous_trip_id is not None and trip_id != previous_trip_id:
+                return position
+            previous_trip_id = trip_id
+
+    @classmethod
+    def load_incremental(cls, data_dir, stop_ids, previous):
+        """
+        Loads stop_times.txt like load, but only parses the rows of the trips that are new or whose content hash
+        changed since previous; the rows of the other trips are copied from previous. The result is identical to
+        a full load. Returns None when the rows of a trip are not contiguous in the file (they usually are), as
+        a trip can then only be compared once the whole file is read.
+        """
+        stop_ids = list(stop_ids)
+        stop_index = {stop_id: index for index, stop_id in enumerate(stop_ids)}
+        previous_trip_index = {trip_id: index for index, trip_id in enumerate(previous.trip_ids)}
+        # Rows of every previous trip, in file order
+        previous_order = np.argsort(previous.column('trips'), kind='stable')
+        previous_trip_indptr = np.zeros(len(previous.trip_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(previous.column('trips'), minlength=len(previous.trip_ids)),
+                  out=previous_trip_indptr[1:])
+        previous_stops = previous.column('stops')
+        # New index of every previous stop, -1 until the stop is seen when it is only in stop_times.txt
+        stop_remap = np.array([stop_index.get(stop_id, -1) for stop_id in previous.stop_ids], dtype=np.int64)
+
+        trip_ids = []
+        trip_index = {}
+        trip_hashes = array('I')
+        trips, stops = array('i'), array('i')
+        arrival_times, departure_times = array('i'), array('i')
+        stop_sequences = array('H')
+        # Rows of the new table, trip by trip: ('parsed', start, end) or ('copied', previous trip, trip)
+        sources = []
+        copied_count = 0
+
+        file_path = os.path.join(data_dir, 'stop_times.txt')
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            trip_column, stop_column = header.index('trip_id'), header.index('stop_id')
+            arrival_column, departure_column = header.index('arrival_time'), header.index('departure_time')
+            sequence_column = header.index('stop_sequence')
+
+            def add_trip(trip_id, rows):
+                nonlocal copied_count
+                trip_hash = 0
+                for row in rows:
+                    trip_hash = cls.hash_row(row, trip_hash)
+                trip = trip_index[trip_id] = len(trip_ids)
+                trip_ids.append(trip_id)
+                trip_hashes.append(trip_hash)
+                previous_trip = previous_trip_index.get(trip_id)
+                if previous_trip is not None and previous.trip_hashes[previous_trip] == trip_hash:
+                    start, end = previous_trip_indptr[previous_trip], previous_trip_indptr[previous_trip + 1]
+                    trip_stops = previous_stops[previous_order[start:end]]
+                    if (stop_remap[trip_stops] < 0).any():
+                        # Number the stops missing from stops.txt in order of appearance, as a full load does
+                        for stop in trip_stops.tolist():
+                            if stop_remap[stop] < 0:
+                                stop_id = previous.stop_ids[stop]
+                                if stop_id not in stop_index:
+                                    stop_index[stop_id] = len(stop_ids)
+                                    stop_ids.append(stop_id)
+                                stop_remap[stop] = stop_index[stop_id]
+                    sources.append(('copied', previous_trip, trip))
+                    copied_count += 1
+                    return
+                start = len(trips)
+                for row in rows:
+                    stop = stop_index.get(row[stop_column])
+                    if stop is None:
+                        stop = stop_index[row[stop_column]] = len(stop_ids)
+                        stop_ids.append(row[stop_column])
+                    trips.append(trip)
+                    stops.append(stop)
+                    arrival_times.append(parse_gtfs_time(row[arrival_column]))
+                    departure_times.append(parse_gtfs_time(row[departure_column]))
+                    stop_sequences.append(int(row[sequence_column]))
+                sources.append(('parsed', start, len(trips)))
+
+            current_trip_id, rows = None, []
+            for row in tqdm(reader, desc="Loading stop times", unit="stop time"):
+                if row[trip_column] != current_trip_id:
+                    if rows:
+                        add_trip(current_trip_id, rows)
+                    current_trip_id, rows = row[trip_column], []
+                    if current_trip_id in trip_index:
+                        logger.info("The stop times of the trips are not contiguous, loading all of them.")
+                        return None
+                rows.append(row)
+            if rows:
+                add_trip(current_trip_id, rows)
+
+        # The rows of the new table are taken from a pool made of the parsed rows followed by the previous rows
+        parsed_count = len(trips)
+        trip_remap = np.full(len(previous.trip_ids), -1, dtype=np.int64)
+        row_groups = [np.zeros(0, dtype=np.int64)]
+        for source in sources:
+            if source[0] == 'parsed':
+                row_groups.append(np.arange(source[1], source[2]))
+            else:
+                trip_remap[source[1]] = source[2]
+                row_groups.append(previous_order[previous_trip_indptr[source[1]]:previous_trip_indptr[source[1] + 1]]
+                                  + parsed_count)
+        pool_rows = np.concatenate(row_groups)
+
+        def merge(parsed, previous_values, typecode):
+            dtype = np.dtype(typecode)
+            pool = np.concatenate([np.asarray(parsed, dtype=dtype), np.asarray(previous_values).astype(dtype)])
+            return to_array(typecode, pool[pool_rows])
+
+        logger.info(f"Stop times: {copied_count} trips unchanged, {len(trip_ids) - copied_count} new or changed, "
+                    f"{len(set(previous.trip_ids) - set(trip_ids))} removed")
+        return cls(trip_ids, stop_ids, merge(trips, trip_remap[previous.column('trips')], 'i'),
+                   merge(stops, stop_remap[previous_stops], 'i'),
+                   merge(arrival_times, previous.column('arrival_times'), 'i'),
+                   merge(departure_times, previous.column('departure_times'), 'i'),
+                   merge(stop_sequences, previous.column('stop_sequences'), 'H'),
+                   trip_hashes=trip_hashes)
+
+    @staticmethod
+    def hash_row(row, trip_hash):
+        """
+        Adds a row of stop_times.txt to the content hash of its trip.
+        """
+        return zlib.crc32('\x1f'.join(row).encode('utf-8'), trip_hash)
+
+    def __len__(self):
+        return len(self.trips)
+
+    @property
+    def stop_row_indptr(self):
+        if self._stop_row_indptr is None:
+            self._build_stop_index()
+        return self._stop_row_indptr
+
+    @property
+    def stop_rows(self):
+        if self._stop_rows is None:
+            self._build_stop_index()
+        return self._stop_rows
+
+    def _build_stop_index(self):
+        """
+        Rows grouped by stop: the rows of the stop at index i are
+        stop_rows[stop_row_indptr[i]:stop_row_indptr[i + 1]], ordered by trip (first appearance) then file order.
+        """
+        stops = self.column('stops')
+        order = np.lexsort((np.arange(len(stops)), self.column('trips'), stops))
+        indptr = np.zeros(len(self.stop_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(stops, minlength=len(self.stop_ids)), out=indptr[1:])
+        self._stop_row_indptr = to_array('i', indptr)
+        self._stop_rows = to_array('i', order)
+
+    @property
+    def departure_indptr(self):
+        if self._departure_indptr is None:
+            self._build_departure_index()
+        return self._departure_indptr
+
+    @property
+    def departure_rows(self):
+        if self._departure_rows is None:
+            self._build_departure_index()
+        return self._departure_rows
+
+    def _build_departure_index(self):
+        """
+        Departures grouped by stop: the rows of the departures from the stop at index i are
+        departure_rows[departure_indptr[i]:departure_indptr[i + 1]], ordered by departure time then row.
+        The last stop time of every trip is not a departure.
+        """
+        order = self.trip_order()
+        same_trip = self.column('trips')[order][1:] == self.column('trips')[order][:-1]
+        rows = order[:-1][same_trip]
+        stops = self.column('stops')[rows]
+        rows = rows[np.lexsort((rows, self.column('departure_times')[rows], stops))]
+        indptr = np.zeros(len(self.stop_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(stops, minlength=len(self.stop_ids)), out=indptr[1:])
+        self._departure_indptr = to_array('i', indptr)
+        self._departure_rows = to_array('i', rows)
+
+    def departures_at_stop(self, stop):
+        """
+        Rows of the departures from a stop (index), ordered by departure time.
+        """
+        return self.departure_rows[self.departure_indptr[stop]:self.departure_indptr[stop + 1]]
+
+    @property
+    def trip_row_indptr(self):
+        if self._trip_row_indptr is None:
+            self._build_trip_index()
+        return self._trip_row_indptr
+
+    @property
+    def trip_rows(self):
+        if self._trip_rows is None:
+            self._build_trip_index()
+        return self._trip_rows
+
+    def _build_trip_index(self):
+        """
+        Rows grouped by trip: the rows of the trip at index i are trip_rows[trip_row_indptr[i]:trip_row_indptr[i + 1]],
+        ordered by stop sequence.
+        """
+        indptr = np.zeros(len(self.trip_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(self.column('trips'), minlength=len(self.trip_ids)), out=indptr[1:])
+        self._trip_row_indptr = to_array('i', indptr)
+        self._trip_rows = to_array('i', self.trip_order())
+
+    def rows_of_trip(self, trip):
+        """
+        Rows of the stop times of a trip (index), ordered by stop sequence.
+        """
+        return self.trip_rows[self.trip_row_indptr[trip]:self.trip_row_indptr[trip + 1]]
+
+    def rows_at_stop(self, stop):
+        """
+        Rows of the stop times of a stop (index), ordered by trip then file order.
+        """
+        return self.stop_rows[self.stop_row_indptr[stop]:self.stop_row_indptr[stop + 1]]
+
+    def column(self, name):
+        """
+        Zero-copy NumPy view over a column.
+        """
+        values = getattr(self, name)
+        if not len(values):
+            return np.zeros(0, np.int32)
+        # array.array (loaded from stop_times.txt) or memoryview (read from the compiled feed)
+        return np.frombuffer(values, dtype=np.dtype(getattr(values, 'typecode', None) or values.format))
+
+    def trip_order(self):
+        """
+        Row order sorting the stop times by trip (first appearance) then stop sequence, stable for equal sequences.
+        """
+        return np.lexsort((self.column('stop_sequences'), self.column('trips')))
+
+    def segments(self):
+        """
+        Consecutive stop times of every trip, as NumPy arrays in (trip, stop sequence) order:
+        (from_stops, to_stops, departure_times, arrival_times, trips).
+        """
+        order = self.trip_order()
+        trips = self.column('trips')[order]
+        stops = self.column('stops')[order]
+        same_trip = trips[1:] == trips[:-1]
+        return (
+            stops[:-1][same_trip],
+            stops[1:][same_trip],
+            self.column('departure_times')[order][:-1][same_trip],
+            self.column('arrival_times')[order][1:][same_trip],
+            trips[:-1][same_trip],
+        )
+
+
+def parse_rows(reader, columns, stop_ids):
+    """
+    Parses the rows of stop_times.txt (lists of fields) into the columns of a StopTimesTable. stop_ids seeds the
+    stop numbering; trips and new stops are numbered in order of first appearance.
+    Returns (trip_ids, stop_ids, trip_hashes, trips, stops, arrival_times, departure_times, stop_sequences).
+    """
+    trip_column, stop_column, arrival_column, departure_column, sequence_column = columns
+    stop_ids = list(stop_ids)
+    stop_index = {stop_id: index for index, stop_id in enumerate(stop_ids)}
+    trip_ids = []
+    trip_index = {}
+    trip_hashes = array('I')
+    trips, stops = array('i'), array('i')
+    arrival_times, departure_times = array('i'), array('i')
+    stop_sequences = array('H')
+    for row in reader:
+        trip = trip_index.get(row[trip_column])
+        if trip is None:
+            trip = trip_index[row[trip_column]] = len(trip_ids)
+            trip_ids.append(row[trip_column])
+            trip_hashes.append(0)
+        stop = stop_index.get(row[stop_column])
+        if stop is None:
+            stop = stop_index[row[stop_column]] = len(stop_ids)
+            stop_ids.append(row[stop_column])
+        trip_hashes[trip] = StopTimesTable.hash_row(row, trip_hashes[trip])
+        trips.append(trip)
+        stops.append(stop)
+        arrival_times.append(parse_gtfs_time(row[arrival_column]))
+        departure_times.append(parse_gtfs_time(row[departure_column]))
+        stop_sequences.append(int(row[sequence_column]))
+    return trip_ids, stop_ids, trip_hashes, trips, stops, arrival_times, departure_times, stop_sequences
+
+
+def parse_shard(file_path, start, end, columns):
+    """
+    Parses the rows of stop_times.txt between the byte offsets start and end (line boundaries), in a worker
+    process of StopTimesTable.load_parallel, with its own numbering of the trips and stops (see parse_rows).
+    """
+    with open(file_path, mode='rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    return parse_rows(csv.reader(io.StringIO(text)), columns, ())
@@ -0,0 +1,55 @@
+import pytest
+
+from services.sncf.sncf_route_finder import SNCFRouteFinder
+
+# Small feed: Auneau -> Paris, then Paris -> Dijon -> Lyon. "Gare de Paris-Gare-de-Lyon" matches both "Paris" and
+# "Lyon".
+FEED = {
+    'stops.txt': [
+        "stop_id,stop_name,stop_desc,stop_lat,stop_lon,zone_id,stop_url,location_type,parent_station",
+        "StopArea:OCE87686006,Gare de Paris-Gare-de-Lyon,,48.844,2.374,,,1,",
+        "StopArea:OCE87723197,Gare de Lyon-Part-Dieu,,45.760,4.859,,,1,",
+        "StopArea:OCE87713040,Gare de Dijon-Ville,,47.323,5.027,,,1,",
+        "StopArea:OCE87394130,Gare de Auneau,,48.460,1.773,,,1,",
+        "StopPoint:OCETGV INOUI-87686006,Gare de Paris-Gare-de-Lyon,,48.844,2.374,,,0,StopArea:OCE87686006",
+        "StopPoint:OCETGV INOUI-87723197,Gare de Lyon-Part-Dieu,,45.760,4.859,,,0,StopArea:OCE87723197",
+        "StopPoint:OCETGV INOUI-87713040,Gare de Dijon-Ville,,47.323,5.027,,,0,StopArea:OCE87713040",
+        "StopPoint:OCETrain TER-87394130,Gare de Auneau,,48.460,1.773,,,0,StopArea:OCE87394130",
+    ],
+    'routes.txt': [
+        "route_id,agency_id,route_short_name,route_long_name,route_desc,route_type,route_url,route_color,"
+        "route_text_color",
+        "OCE1,OCESN,,Paris - Lyon,,2,,,",
+        "OCE2,OCESN,,Auneau - Paris,,2,,,",
+    ],
+    'trips.txt': [
+        "route_id,service_id,trip_id,trip_headsign,direction_id,block_id,shape_id",
+        "OCE1,1,TRIP1,6601,0,,",
+        "OCE2,1,TRIP2,16001,0,,",
+    ],
+    'stop_times.txt': [
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,"
+        "shape_dist_traveled",
+        "TRIP1,08:00:00,08:00:00,StopPoint:OCETGV INOUI-87686006,0,,0,0,",
+        "TRIP1,09:35:00,09:40:00,StopPoint:OCETGV INOUI-87713040,1,,0,0,",
+        "TRIP1,10:50:00,10:50:00,StopPoint:OCETGV INOUI-87723197,2,,0,0,",
+        "TRIP2,06:30:00,06:30:00,StopPoint:OCETrain TER-87394130,0,,0,0,",
+        "TRIP2,07:30:00,07:30:00,StopPoint:OCETGV INOUI-87686006,1,,0,0,",
+    ],
+    'calendar.txt': [
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date",
+        "1,1,1,1,1,1,1,1,20240101,20241231",
+    ],
+    'calendar_dates.txt': [
+        "service_id,date,exception_type",
+    ],
+}
+
+
+@pytest.fixture(scope='session')
+def route_finder(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('data_sncf')
+    for file_name, lines in FEED.items():
+        (data_dir / file_name).write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return SNCFRouteFinder(str(data_dir), compiled_path=str(data_dir / 'sncf_feed.bin'), use_compiled=False,
+                           commune_coordinates_path=str(data_dir / 'city_coordinates.csv'))
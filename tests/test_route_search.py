@@ -0,0 +1,73 @@
+import math
+import random
+
+from services.sncf.route_graph import RouteGraph
+from services.sncf.route_search import RouteSearch, DIJKSTRA, ASTAR, CSGRAPH
+
+
+def random_graph(seed, node_count=100, edge_count=400, zero_edge_ratio=0.02):
+    """
+    Random graph over stops of northern France, every stop linked to its nearest stops with travel times following
+    the distances (about 300 km/h) except for a share of 0 minute edges between distinct stops.
+    """
+    rng = random.Random(seed)
+    latitudes = [47.0 + 2 * rng.random() for _ in range(node_count)]
+    longitudes = [1.0 + 3 * rng.random() for _ in range(node_count)]
+    graph = RouteGraph(list(range(node_count)), [0], [], [], latitudes, longitudes)
+    from_stops, to_stops, weights = [], [], []
+    for _ in range(edge_count):
+        origin = rng.randrange(node_count)
+        nearest = sorted(range(node_count), key=lambda stop: graph.distance_km(origin, stop))[1:6]
+        destination = rng.choice(nearest)
+        minutes = 0 if rng.random() < zero_edge_ratio else math.ceil(graph.distance_km(origin, destination) / 5)
+        from_stops.append(origin)
+        to_stops.append(destination)
+        weights.append(minutes)
+    return RouteGraph.from_segments(graph.stop_ids, latitudes, longitudes, from_stops, to_stops, weights,
+                                    list(range(edge_count)))
+
+
+def compare_astar_with_dijkstra(graph, seed, query_count):
+    """
+    Runs query_count random queries with both algorithms, checks that they find routes of the same cost and
+    returns the numbers of stops settled by A* and by Dijkstra.
+    """
+    route_search = RouteSearch(graph)
+    rng = random.Random(seed)
+    astar_settled, dijkstra_settled = 0, 0
+    for _ in range(query_count):
+        sources, goals = rng.sample(range(len(graph)), 2), rng.sample(range(len(graph)), 2)
+        expected = route_search.shortest_path(sources, goals, DIJKSTRA)
+        result = route_search.shortest_path(sources, goals, ASTAR)
+        assert result.cost == expected.cost
+        astar_settled += result.settled_count
+        dijkstra_settled += expected.settled_count
+    return astar_settled, dijkstra_settled
+
+
+def test_astar_matches_dijkstra_with_zero_minute_edges():
+    astar_settled, dijkstra_settled = 0, 0
+    for seed in range(20):
+        graph = random_graph(seed)
+        assert len(graph.unbounded_stops)
+        settled = compare_astar_with_dijkstra(graph, seed, 30)
+        astar_settled, dijkstra_settled = astar_settled + settled[0], dijkstra_settled + settled[1]
+    # The heuristic is kept despite the 0 minute edges
+    assert astar_settled < dijkstra_settled
+
+
+def test_astar_settles_fewer_stops_than_dijkstra():
+    graph = random_graph(0, zero_edge_ratio=0)
+    assert not len(graph.unbounded_stops)
+    astar_settled, dijkstra_settled = compare_astar_with_dijkstra(graph, 0, 50)
+    assert astar_settled < dijkstra_settled * 0.8
+
+
+def test_negative_segments_are_dropped():
+    graph = RouteGraph.from_segments(['A', 'B', 'C'], [48.0, 48.1, 48.2], [2.0, 2.1, 2.2],
+                                     [0, 0, 1, 0], [1, 2, 2, 1], [10, 30, 5, -3], [0, 1, 2, 3])
+    assert min(graph.weights) >= 0
+    assert graph.edge_trips[graph.indptr[0]:graph.indptr[1]].tolist() == [0, 1]
+    route_search = RouteSearch(graph)
+    for algorithm in (DIJKSTRA, ASTAR, CSGRAPH):
+        assert route_search.shortest_path([0], [2], algorithm).cost == 15
@@ -0,0 +1,24 @@
+from services.sncf.fuzzy_name_index import FuzzyNameIndex
+
+
+def test_station_name_is_not_snapped_to_another_city(route_finder):
+    city_name_index = FuzzyNameIndex(['Duneau', 'Montpellier', 'Paris'])
+    assert route_finder.snap_city_name('Auneau', city_name_index) == 'Auneau'
+    assert route_finder.snap_city_name('Montpelier', city_name_index) == 'Montpellier'
+
+
+def test_stop_named_after_both_cities_is_not_a_destination(route_finder):
+    # "Gare de Paris-Gare-de-Lyon" matches Paris and Lyon
+    lyon_part_dieu = route_finder.stops.stop_index['StopPoint:OCETGV INOUI-87723197']
+    # The graph search leaves out the 5 minute stop at Dijon, the direct train includes it
+    for direct_first, cost in ((False, 165), (True, 170)):
+        result = route_finder.search_route('Paris', 'Lyon', direct_first=direct_first)
+        assert result.cost == cost
+        assert result.path[-1] == lyon_part_dieu
+    assert route_finder.search_routes('Paris', ['Lyon'])['Lyon'].cost == 165
+    assert route_finder.search_route('Paris', 'Paris') is None
+
+
+def test_dated_search_uses_the_running_trips(route_finder):
+    assert route_finder.search_route('Paris', 'Lyon', date='2024-06-01').cost == 165
+    assert route_finder.search_route('Paris', 'Lyon', date='2025-06-01').path is None
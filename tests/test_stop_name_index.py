@@ -0,0 +1,21 @@
+from services.sncf.stop_name_index import StopNameIndex
+
+NAMES = ["Gare de Strasbourg", "Gare de St-Pierre-des-Corps", "Gare de Sainte-Foy", "Gare de Paris-Est",
+         "Gare de Lyon-Part-Dieu"]
+
+
+def substring_matches(query):
+    return [stop for stop, name in enumerate(NAMES) if query.lower() in name.lower()]
+
+
+def test_lookup_returns_the_substring_matches():
+    index = StopNameIndex(NAMES)
+    for query in ("st", "St-P", "Gare de St", "Ste", "Est", "Part-Dieu", "gare de"):
+        assert set(substring_matches(query)) <= set(index.lookup(query)), query
+
+
+def test_lookup_folds_accents_and_abbreviations():
+    index = StopNameIndex(NAMES)
+    assert index.lookup("Saint Pierre des Corps") == [1]
+    assert index.lookup("Ste Foy") == [2]
+    assert index.lookup("Lyon Part Dieu") == [4]